@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк AnalyticsRecorder: стоимость record() в обработчике, пропускная
+способность фонового flusher и устойчивая скорость записи без потерь.
+
+Реальный бенчмарк - с --dsn: пакеты пишутся в PostgreSQL через
+BotInfrastructure._write_analytics_batch (COPY), события бенчмарка пишутся с
+event_type='benchmark' и удаляются в конце. Без --dsn запись пакета
+имитируется фиксированной задержкой, и скорости сброса в выводе помечены как
+SIMULATED: они характеризуют буфер и flusher, а не базу данных.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram_bot import AnalyticsRecorder, BotInfrastructure, DB_AVAILABLE
+
+EVENT_TYPE = 'benchmark'
+
+
+class CopyWriter:
+    """Путь записи бота (COPY на отдельном подключении) с подключением по DSN"""
+
+    _write_analytics_batch = BotInfrastructure._write_analytics_batch
+    _copy_analytics_batch = BotInfrastructure._copy_analytics_batch
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._analytics_connection = None
+        self._analytics_lock = threading.Lock()
+
+    def _connect_database(self):
+        import psycopg2
+        return psycopg2.connect(self.dsn)
+
+    def cleanup(self):
+        if self._analytics_connection is None or self._analytics_connection.closed:
+            return
+        with self._analytics_connection.cursor() as cursor:
+            cursor.execute("DELETE FROM analytics_events WHERE event_type = %s", (EVENT_TYPE,))
+        self._analytics_connection.commit()
+        self._analytics_connection.close()
+
+
+def record_events(recorder: AnalyticsRecorder, start: int, count: int):
+    for i in range(start, start + count):
+        recorder.record(EVENT_TYPE, chat_id=i, user_id=i, payload={'command': 'start_command'})
+
+
+async def run(args):
+    mode = '' if args.dsn else ' [SIMULATED]'
+    if args.dsn:
+        writer = CopyWriter(args.dsn)
+
+        async def write_batch(batch):
+            # Как в боте: блокирующий COPY в отдельном потоке
+            await asyncio.to_thread(writer._write_analytics_batch, batch)
+    else:
+        writer = None
+        print(f"⚠️  SIMULATED: запись пакета имитируется задержкой {args.batch_latency * 1000:.1f} ms, "
+              f"PostgreSQL не используется; реальный бенчмарк - с --dsn postgresql://...")
+
+        async def write_batch(batch):
+            # Имитация COPY в PostgreSQL: фиксированная задержка на пакет
+            await asyncio.sleep(args.batch_latency)
+
+    # 1. Стоимость record() без конкуренции с flusher (буфер вмещает все события)
+    recorder = AnalyticsRecorder(write_batch, max_buffer=args.events,
+                                 batch_size=args.batch_size, flush_interval=0.5)
+    start = time.perf_counter()
+    record_events(recorder, 0, args.events)
+    record_elapsed = time.perf_counter() - start
+    print(f"record():   {args.events / record_elapsed:,.0f} events/s "
+          f"({record_elapsed / args.events * 1e9:.0f} ns/event), dropped={recorder.stats['dropped']}")
+
+    # 2. Пропускная способность flusher: сброс заполненного буфера
+    start = time.perf_counter()
+    await recorder.flush()
+    flush_elapsed = time.perf_counter() - start
+    capacity = recorder.stats['written'] / flush_elapsed
+    print(f"flush:      {capacity:,.0f} events/s ({recorder.stats['batches']} batches of "
+          f"{args.batch_size}, {flush_elapsed / max(1, recorder.stats['batches']) * 1000:.1f} ms/batch), "
+          f"failed={recorder.stats['failed']}{mode}")
+
+    # 3. Устойчивая запись: обработчики с постоянной скоростью ниже capacity,
+    #    flusher работает параллельно; потерь быть не должно
+    rate = args.rate or capacity * 0.8
+    recorder = AnalyticsRecorder(write_batch, max_buffer=args.max_buffer,
+                                 batch_size=args.batch_size, flush_interval=0.5)
+    flusher = asyncio.create_task(recorder.run())
+    tick = 0.01
+    peak_buffered = 0
+    produced = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        due = int(rate * (time.perf_counter() - start)) - produced
+        if due > 0:
+            record_events(recorder, produced, due)
+            produced += due
+        peak_buffered = max(peak_buffered, len(recorder._buffer))
+        # Отдаем управление event loop, как это происходит между апдейтами
+        await asyncio.sleep(tick)
+    # Как при остановке бота: flusher доводит текущий пакет и сбрасывает остаток
+    recorder.stop()
+    await flusher
+    sustained_elapsed = time.perf_counter() - start
+
+    stats = recorder.snapshot()
+    print(f"sustained:  offered {produced / args.duration:,.0f} events/s, "
+          f"written {stats['written'] / sustained_elapsed:,.0f} events/s, "
+          f"dropped={stats['dropped']}, failed={stats['failed']}, "
+          f"peak buffered={peak_buffered}/{args.max_buffer}{mode}")
+    if stats['dropped']:
+        print(f"            ⚠️  offered rate exceeds what the flusher sustains - lower --rate "
+              f"or raise --max-buffer/--batch-size")
+
+    if writer is not None:
+        await asyncio.to_thread(writer.cleanup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analytics recorder")
+    parser.add_argument('--events', type=int, default=200000,
+                        help="events for the record() and flush capacity runs")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--batch-latency', type=float, default=0.005,
+                        help="simulated seconds per batch write (ignored with --dsn)")
+    parser.add_argument('--max-buffer', type=int, default=10000)
+    parser.add_argument('--rate', type=float,
+                        help="events per second in the sustained run (default: 80%% of flush capacity)")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds of the sustained run")
+    parser.add_argument('--dsn', help="PostgreSQL DSN for the real benchmark: write batches via COPY "
+                                      "instead of simulating them (use a scratch database)")
+    args = parser.parse_args()
+
+    if args.dsn and not DB_AVAILABLE:
+        print("❌ psycopg2 не установлен - установите зависимости:")
+        print("   pip install -r requirements.txt")
+        sys.exit(1)
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
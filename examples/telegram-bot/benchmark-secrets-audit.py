@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк журнала доступа к секретам: накладные расходы record() на чтение
+секрета из кэша и стоимость фонового сброса с агрегацией повторных чтений
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram_bot import SecretsManager, SecretAuditLog
+
+
+class _NoAudit:
+    def record(self, name, source, depth=2):
+        pass
+
+
+def measure(secrets: SecretsManager, reads: int, names: list) -> float:
+    """Среднее время get_secret() из кэша, нс"""
+    start = time.perf_counter()
+    for i in range(reads):
+        secrets.get_secret(names[i % len(names)])
+    return (time.perf_counter() - start) / reads * 1e9
+
+
+async def run(reads: int, distinct: int, buffer_size: int):
+    names = [f'bench-secret-{i}' for i in range(distinct)]
+    for name in names:
+        os.environ[name.upper().replace('-', '_')] = 'x' * 32
+
+    secrets = SecretsManager()
+    for name in names:
+        secrets.get_secret(name)
+
+    # 1. get_secret() из кэша без журнала и с журналом
+    secrets.audit = _NoAudit()
+    baseline = measure(secrets, reads, names)
+    secrets.audit = SecretAuditLog(max_buffer=buffer_size)
+    audited = measure(secrets, reads, names)
+    print(f"get_secret(): {baseline:.0f} ns without audit, {audited:.0f} ns with audit "
+          f"(overhead {audited - baseline:.0f} ns/read)")
+
+    # 2. Сброс: агрегация буфера и дозапись в файл
+    with tempfile.TemporaryDirectory() as tmp:
+        secrets.audit.path = os.path.join(tmp, 'secrets-audit.log')
+        pending = secrets.audit.snapshot()['buffered']
+        start = time.perf_counter()
+        records = await secrets.audit.flush()
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(secrets.audit.path)
+
+    stats = secrets.audit.snapshot()
+    print(f"flush():      {stats['recorded']} reads in {pending} counters -> {records} records "
+          f"({stats['aggregated']} reads, {size} bytes) in {elapsed * 1000:.1f} ms, "
+          f"dropped={stats['dropped']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark secrets access audit log")
+    parser.add_argument('--reads', type=int, default=1000000)
+    parser.add_argument('--distinct', type=int, default=20,
+                        help="number of distinct secrets read in a loop")
+    parser.add_argument('--buffer-size', type=int, default=4096,
+                        help="max distinct read sites held between flushes")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.reads, args.distinct, args.buffer_size))
+
+
+if __name__ == '__main__':
+    main()
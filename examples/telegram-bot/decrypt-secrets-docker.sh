@@ -18,6 +18,9 @@ fi
 # Создание директории для секретов (tmpfs volume)
 mkdir -p "$SECRETS_DIR"
 
+# Расшифрованные файлы создаются сразу с правами только для владельца
+umask 077
+
 # Проверка GPG ключа
 if ! gpg --list-keys "$GPG_RECIPIENT" >/dev/null 2>&1; then
     echo "Warning: GPG key '$GPG_RECIPIENT' not found"
@@ -33,15 +36,18 @@ if [ -d "$ENCRYPTED_DIR" ]; then
         if [ -f "$encrypted_file" ]; then
             secret_name=$(basename "$encrypted_file" .gpg)
             secret_path="$SECRETS_DIR/$secret_name"
+            tmp_path="$SECRETS_DIR/.$secret_name.tmp"
 
             echo "Decrypting $secret_name..."
 
-            # Дешифрация с автоматическим подтверждением
-            if gpg --batch --yes --decrypt "$encrypted_file" > "$secret_path" 2>/dev/null; then
+            # Дешифрация потоком в файл (без буферизации в shell) и атомарная замена
+            if gpg --batch --yes --output "$tmp_path" --decrypt "$encrypted_file" 2>/dev/null; then
                 # Установка правильных прав
-                chmod 0400 "$secret_path"
+                chmod 0400 "$tmp_path"
+                mv -f "$tmp_path" "$secret_path"
                 echo "✓ Secret $secret_name decrypted successfully"
             else
+                rm -f "$tmp_path"
                 echo "✗ Failed to decrypt $secret_name"
                 # Не прерываем выполнение, продолжаем с другими секретами
             fi
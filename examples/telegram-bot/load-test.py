@@ -0,0 +1,643 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест Telegram бота с fake Bot API
+
+Дочерний процесс поднимает fake Bot API (getMe/getUpdates/sendMessage/
+setWebhook/deleteWebhook) и генерирует апдейты с заданной скоростью и
+смесью команд. Основной процесс запускает настоящий TelegramBot (или
+BotHost при --bots > 1), направленный на fake API через
+TELEGRAM_API_BASE_URL, и измеряет event-loop lag и RSS бота.
+
+Отчет: апдейты в секунду, перцентили задержки ответа, lag, RSS по времени.
+
+С --broadcast N апдейты не генерируются: в хранилище рассылок бота
+(Redis, если доступен, иначе очередь в памяти) добавляются N подписчиков
+и ставится рассылка; отчет - сообщений в секунду против лимита
+notifications-rate-per-second. --inject-429 P включает flood control:
+sendMessage с вероятностью P открывает окно retry_after, в котором все
+sendMessage получают 429, как в настоящем Bot API.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+try:
+    from aiohttp import web
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    web = None
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+    psutil = None
+
+TOKEN_TEMPLATE = '10000{index}:LOADTEST{index}'
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Перцентиль по отсортированной выборке"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def ms(value: Optional[float]) -> str:
+    return f"{value * 1000:8.1f}" if value is not None else "     n/a"
+
+
+class MemoryBroadcastStore:
+    """Очередь рассылок в памяти с интерфейсом BroadcastStore (когда нет Redis)"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._jobs: Dict[str, Dict] = {}
+        self._queue: List[str] = []
+
+    def add_subscriber(self, chat_id: int):
+        self._subscribers.add(chat_id)
+
+    def remove_subscriber(self, chat_id: int):
+        self._subscribers.discard(chat_id)
+
+    def subscribers(self) -> List[int]:
+        return sorted(self._subscribers)
+
+    def create_job(self, text: str, chat_ids: List[int]) -> str:
+        job_id = f'load{len(self._jobs)}'
+        self._jobs[job_id] = {'id': job_id, 'text': text, 'status': 'queued', 'total': len(chat_ids),
+                              'cursor': 0, 'sent': 0, 'failed': 0, 'chats': list(chat_ids)}
+        self._queue.append(job_id)
+        return job_id
+
+    def next_job(self) -> Optional[Dict]:
+        return dict(self._jobs[self._queue[0]]) if self._queue else None
+
+    def get_chunk(self, job_id: str, cursor: int, size: int) -> List[int]:
+        return self._jobs[job_id]['chats'][cursor:cursor + size]
+
+    def advance(self, job_id: str, count: int, sent: int, failed: int):
+        job = self._jobs[job_id]
+        job['status'] = 'running'
+        job['cursor'] += count
+        job['sent'] += sent
+        job['failed'] += failed
+
+    def finish(self, job_id: str):
+        self._jobs[job_id]['status'] = 'done'
+        self._queue.remove(job_id)
+
+
+class FakeBotState:
+    """Очередь апдейтов и ожидающие ответа сообщения одного бота"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.updates: List[dict] = []
+        self.next_update_id = 1
+        self.new_update = asyncio.Event()
+        self.pending: Dict[int, deque] = {}
+        self.message_id = 0
+        self.webhook_url = ''
+
+
+class FakeBotAPI:
+    """Минимальный Bot API, достаточный для python-telegram-bot"""
+
+    def __init__(self, tokens: List[str], flood_probability: float = 0.0, retry_after: int = 1):
+        self.bots = {token: FakeBotState(i) for i, token in enumerate(tokens)}
+        self.generated = 0
+        self.replied = 0
+        self.unmatched = 0
+        self.unmatched_times: List[float] = []
+        self.unmatched_chats = set()
+        self.flood_probability = flood_probability
+        self.retry_after = retry_after
+        self.flood_until = 0.0
+        self.flood_seconds = 0.0
+        self.throttled = 0
+        self.polling = set()
+        self.latencies: List[float] = []
+
+    def push_update(self, token: str, chat_id: int, text: str):
+        bot = self.bots[token]
+        update_id = bot.next_update_id
+        bot.next_update_id += 1
+        command = text.split()[0]
+        bot.updates.append({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+            },
+        })
+        bot.pending.setdefault(chat_id, deque()).append(time.monotonic())
+        bot.new_update.set()
+        self.generated += 1
+
+    async def _params(self, request) -> dict:
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = dict(await request.post())
+        return params
+
+    def _message(self, bot: FakeBotState, chat_id: int, text: str) -> dict:
+        bot.message_id += 1
+        return {
+            'message_id': bot.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+            'from': {'id': 100000 + bot.index, 'is_bot': True, 'first_name': 'LoadTest'},
+            'text': text,
+        }
+
+    async def handle(self, request):
+        token = request.match_info['token']
+        method = request.match_info['method']
+        bot = self.bots.get(token)
+        if bot is None:
+            return web.json_response({'ok': False, 'error_code': 401, 'description': 'Unauthorized'}, status=401)
+        params = await self._params(request)
+        handler = getattr(self, f'api_{method}', None)
+        if handler is None:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found'}, status=404)
+        if method == 'sendMessage' and self.flood_probability:
+            flood = self._flood_control()
+            if flood is not None:
+                return flood
+        result = await handler(bot, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    def _flood_control(self):
+        """429 в открытом окне flood control; новое окно открывается с вероятностью flood_probability"""
+        now = time.monotonic()
+        if now >= self.flood_until:
+            if random.random() >= self.flood_probability:
+                return None
+            self.flood_until = now + self.retry_after
+            self.flood_seconds += self.retry_after
+        self.throttled += 1
+        retry_after = max(1, math.ceil(self.flood_until - now))
+        return web.json_response({
+            'ok': False,
+            'error_code': 429,
+            'description': f'Too Many Requests: retry after {retry_after}',
+            'parameters': {'retry_after': retry_after},
+        }, status=429)
+
+    async def api_getMe(self, bot, params):
+        return {
+            'id': 100000 + bot.index,
+            'is_bot': True,
+            'first_name': 'LoadTest',
+            'username': f'load_test_{bot.index}_bot',
+            'can_join_groups': True,
+            'can_read_all_group_messages': False,
+            'supports_inline_queries': False,
+        }
+
+    async def api_getUpdates(self, bot, params):
+        self.polling.add(bot.index)
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        if offset:
+            bot.updates = [u for u in bot.updates if u['update_id'] >= offset]
+        if not bot.updates and timeout > 0:
+            bot.new_update.clear()
+            try:
+                await asyncio.wait_for(bot.new_update.wait(), min(timeout, 1.0))
+            except asyncio.TimeoutError:
+                pass
+        return bot.updates[:limit]
+
+    async def api_sendMessage(self, bot, params):
+        chat_id = int(params['chat_id'])
+        pending = bot.pending.get(chat_id)
+        if pending:
+            # Апдейты одного чата обрабатываются по порядку - сопоставляем FIFO
+            self.latencies.append(time.monotonic() - pending.popleft())
+            self.replied += 1
+        else:
+            # Сообщение не в ответ на апдейт - в режиме --broadcast это рассылка
+            self.unmatched += 1
+            self.unmatched_times.append(time.monotonic())
+            self.unmatched_chats.add(chat_id)
+        return self._message(bot, chat_id, params.get('text', ''))
+
+    async def api_setWebhook(self, bot, params):
+        bot.webhook_url = params.get('url', '')
+        return True
+
+    async def api_deleteWebhook(self, bot, params):
+        bot.webhook_url = ''
+        if str(params.get('drop_pending_updates', '')).lower() == 'true':
+            bot.updates.clear()
+        return True
+
+    async def api_getWebhookInfo(self, bot, params):
+        return {'url': bot.webhook_url, 'has_custom_certificate': False,
+                'pending_update_count': len(bot.updates)}
+
+    async def api_close(self, bot, params):
+        return True
+
+    async def api_logOut(self, bot, params):
+        return True
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """start=1,ping=5 -> {'/start': 1.0, '/ping': 5.0}"""
+    weights = {}
+    for item in mix.split(','):
+        command, _, weight = item.partition('=')
+        weights['/' + command.strip().lstrip('/')] = float(weight or 1)
+    return weights
+
+
+async def generate(api: FakeBotAPI, tokens: List[str], args):
+    """Генерация апдейтов с постоянной скоростью"""
+    mix = parse_mix(args.mix)
+    commands, weights = list(mix), list(mix.values())
+    interval = 1.0 / args.rate
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < args.duration:
+        target = start + sent * interval
+        delay = target - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        command = random.choices(commands, weights)[0]
+        chat_id = random.randint(1, args.chats)
+        api.push_update(random.choice(tokens), chat_id, command)
+        sent += 1
+
+
+async def receive(conn):
+    """Неблокирующее чтение сообщения из Pipe"""
+    while not conn.poll():
+        await asyncio.sleep(0.01)
+    return conn.recv()
+
+
+async def wait_for_event(conn, event: str) -> dict:
+    """Пропустить сообщения из Pipe до события event"""
+    message = await receive(conn)
+    while message['event'] != event:
+        message = await receive(conn)
+    return message
+
+
+async def serve_fake_api(args, conn):
+    """Дочерний процесс: fake API, генератор и поинтервальная статистика"""
+    tokens = [TOKEN_TEMPLATE.format(index=i) for i in range(args.bots)]
+    api = FakeBotAPI(tokens, args.inject_429, args.retry_after)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.port).start()
+    conn.send({'event': 'ready'})
+
+    # Ждем, пока все боты начнут polling
+    while len(api.polling) < args.bots:
+        await asyncio.sleep(0.05)
+    conn.send({'event': 'started'})
+
+    if args.broadcast:
+        # Апдейты не генерируются; ждем, пока рассылка при заданном лимите должна завершиться
+        generator = asyncio.create_task(asyncio.sleep(args.broadcast / args.broadcast_rate))
+        finished = lambda: api.unmatched >= args.broadcast
+    else:
+        generator = asyncio.create_task(generate(api, tokens, args))
+        finished = lambda: api.replied >= api.generated
+    deadline = None
+    last_generated = last_replied = last_unmatched = 0
+    while True:
+        await asyncio.sleep(args.report_interval)
+        latencies, api.latencies = api.latencies, []
+        conn.send({
+            'event': 'interval',
+            'generated': api.generated - last_generated,
+            'replied': api.replied - last_replied,
+            'unmatched': api.unmatched - last_unmatched,
+            'latencies': latencies,
+        })
+        last_generated, last_replied, last_unmatched = api.generated, api.replied, api.unmatched
+
+        if finished() and args.broadcast:
+            break
+        if generator.done():
+            deadline = deadline or time.monotonic() + args.drain_timeout
+            # Окна flood control приостанавливают рассылку и продлевают ее
+            if finished() or time.monotonic() >= deadline + api.flood_seconds:
+                break
+
+    rates = {}
+    if args.broadcast:
+        times = api.unmatched_times
+        # Token bucket отдает первые rate сообщений сразу (burst); установившаяся
+        # скорость считается после него и должна совпадать с лимитом
+        burst = int(args.broadcast_rate)
+        rates['overall'] = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 else None
+        rates['steady'] = ((len(times) - burst - 1) / (times[-1] - times[burst])
+                           if len(times) > burst + 1 else None)
+        # Во время окон flood control отправка приостановлена целиком - без них
+        # скорость должна оставаться у лимита
+        sending = times[-1] - times[burst] - api.flood_seconds if len(times) > burst + 1 else 0
+        rates['steady_excluding_flood'] = (len(times) - burst - 1) / sending if sending > 0 else None
+    conn.send({'event': 'done', 'generated': api.generated, 'replied': api.replied,
+               'unmatched': api.unmatched, 'broadcast_rates': rates,
+               'unique_chats': len(api.unmatched_chats), 'throttled': api.throttled,
+               'flood_seconds': api.flood_seconds})
+    # Продолжаем отвечать, пока бот не остановит polling
+    await receive(conn)
+    await runner.cleanup()
+
+
+def run_fake_api(args, conn):
+    asyncio.run(serve_fake_api(args, conn))
+
+
+async def monitor_loop_lag(samples: List[float], interval: float = 0.05):
+    """Задержка event loop: насколько sleep(interval) просыпается позже"""
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.monotonic() - start - interval))
+
+
+def seed_broadcast(store, count: int) -> str:
+    """Добавить count подписчиков и поставить рассылку, как /broadcast"""
+    for chat_id in range(1, count + 1):
+        store.add_subscriber(chat_id)
+    return store.create_job('Load test broadcast', store.subscribers())
+
+
+async def drive_bot(args, conn) -> dict:
+    """Основной процесс: настоящий бот под нагрузкой"""
+    from telegram_bot import TelegramBot, BotHost
+
+    if args.bots > 1:
+        runner = BotHost()
+        run = runner.run_bots
+        is_running = lambda: all(bot.running for bot in runner.bots.values())
+    else:
+        runner = TelegramBot()
+        run = runner.run_bot
+        is_running = lambda: runner.running
+
+    if args.broadcast and runner.broadcast is None:
+        # Redis недоступен - тот же планировщик поверх очереди в памяти
+        from telegram_bot import BroadcastScheduler
+        runner.broadcast = BroadcastScheduler(
+            MemoryBroadcastStore(),
+            runner._send_message,
+            lambda func, *func_args: asyncio.to_thread(func, *func_args),
+            rate_per_second=args.broadcast_rate,
+            per_chat_interval=runner.config.get('notifications_per_chat_interval_seconds') or 1.0
+        )
+
+    runner.start_background_tasks()
+    bot_task = asyncio.create_task(run())
+    lag_samples: List[float] = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    process = psutil.Process() if PSUTIL_AVAILABLE else None
+
+    started = asyncio.create_task(wait_for_event(conn, 'started'))
+    await asyncio.wait({started, bot_task}, return_when=asyncio.FIRST_COMPLETED)
+    if not started.done():
+        # Бот завершился до polling - fake API никогда не пришлет 'started'
+        started.cancel()
+        lag_task.cancel()
+        await runner.stop_background_tasks()
+        raise bot_task.exception() or RuntimeError("Bot stopped before polling started")
+    if not is_running():
+        raise RuntimeError("Bot did not start")
+
+    if args.broadcast:
+        store = runner.broadcast.store
+        job_id = await asyncio.to_thread(seed_broadcast, store, args.broadcast)
+        print(f"📣 Рассылка {job_id}: {args.broadcast} подписчиков, "
+              f"лимит {args.broadcast_rate:g} msg/s ({type(store).__name__})")
+        print(f"{'t,s':>6} {'msg/s':>8} {'limit':>8} "
+              f"{'lag p99':>8} {'lag max':>8} {'rss,MB':>8}")
+    else:
+        print(f"{'t,s':>6} {'gen/s':>8} {'upd/s':>8} {'p50,ms':>8} {'p99,ms':>8} "
+              f"{'lag p99':>8} {'lag max':>8} {'rss,MB':>8}")
+    timeline = []
+    all_latencies: List[float] = []
+    all_lag: List[float] = []
+    started = time.monotonic()
+
+    while True:
+        message = await receive(conn)
+        if message['event'] == 'done':
+            break
+        lag, lag_samples[:] = list(lag_samples), []
+        all_lag.extend(lag)
+        all_latencies.extend(message['latencies'])
+        rss = process.memory_info().rss / 1024 / 1024 if process else None
+        row = {
+            't': round(time.monotonic() - started, 1),
+            'generated_per_second': message['generated'] / args.report_interval,
+            'updates_per_second': message['replied'] / args.report_interval,
+            'messages_per_second': message['unmatched'] / args.report_interval,
+            'latency_p50': percentile(message['latencies'], 50),
+            'latency_p99': percentile(message['latencies'], 99),
+            'loop_lag_p99': percentile(lag, 99),
+            'loop_lag_max': max(lag) if lag else None,
+            'rss_mb': rss,
+        }
+        timeline.append(row)
+        if args.broadcast:
+            print(f"{row['t']:6.1f} {row['messages_per_second']:8.1f} {args.broadcast_rate:8.1f} "
+                  f"{ms(row['loop_lag_p99'])} {ms(row['loop_lag_max'])} "
+                  f"{rss if rss is not None else float('nan'):8.1f}")
+            continue
+        print(f"{row['t']:6.1f} {row['generated_per_second']:8.1f} {row['updates_per_second']:8.1f} "
+              f"{ms(row['latency_p50'])} {ms(row['latency_p99'])} "
+              f"{ms(row['loop_lag_p99'])} {ms(row['loop_lag_max'])} "
+              f"{rss if rss is not None else float('nan'):8.1f}")
+
+    elapsed = time.monotonic() - started
+    broadcast = None
+    if args.broadcast:
+        delivered = message['unmatched']
+        store = runner.broadcast.store
+        if hasattr(store, 'subscribers_key'):
+            # Не оставляем тестовых подписчиков в Redis
+            await asyncio.to_thread(store.redis.delete, store.subscribers_key)
+        broadcast = {
+            'subscribers': args.broadcast,
+            'delivered': delivered,
+            'messages_per_second': message['broadcast_rates']['overall'],
+            'steady_messages_per_second': message['broadcast_rates']['steady'],
+            'steady_excluding_flood': message['broadcast_rates']['steady_excluding_flood'],
+            'duplicates': delivered - message['unique_chats'],
+            'api_throttled': message['throttled'],
+            'flood_seconds': message['flood_seconds'],
+            'rate_limit_per_second': args.broadcast_rate,
+            'store': type(store).__name__,
+            'scheduler': runner.broadcast.snapshot(),
+        }
+    await runner.stop()
+    try:
+        await asyncio.wait_for(bot_task, timeout=10)
+    except Exception:
+        pass
+    await runner.stop_background_tasks()
+    lag_task.cancel()
+    conn.send({'event': 'stop'})
+
+    rss_values = [row['rss_mb'] for row in timeline if row['rss_mb'] is not None]
+    # Устойчивая пропускная способность - по интервалам, когда шла генерация
+    loaded = [row for row in timeline if row['generated_per_second'] > 0]
+    return {
+        'config': {'rate': args.rate, 'duration': args.duration, 'chats': args.chats,
+                   'bots': args.bots, 'mix': args.mix, 'broadcast': args.broadcast},
+        'generated': message['generated'],
+        'replied': message['replied'],
+        'lost': message['generated'] - message['replied'],
+        'unmatched_replies': message['unmatched'],
+        'updates_per_second': sum(row['updates_per_second'] for row in loaded) / len(loaded) if loaded else 0.0,
+        'elapsed_seconds': round(elapsed, 1),
+        'latency': {p: percentile(all_latencies, float(p[1:])) for p in ('p50', 'p90', 'p99')}
+                   | {'max': max(all_latencies) if all_latencies else None},
+        'loop_lag': {'p50': percentile(all_lag, 50), 'p99': percentile(all_lag, 99),
+                     'max': max(all_lag) if all_lag else None},
+        'rss_mb': {'start': rss_values[0] if rss_values else None,
+                   'peak': max(rss_values) if rss_values else None,
+                   'end': rss_values[-1] if rss_values else None},
+        'broadcast': broadcast,
+        'timeline': timeline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Telegram bot against a fake Bot API")
+    parser.add_argument('--rate', type=float, default=50, help="updates per second")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of load")
+    parser.add_argument('--chats', type=int, default=100, help="number of distinct chats")
+    parser.add_argument('--bots', type=int, default=1, help="bots in one process (BotHost when > 1)")
+    parser.add_argument('--mix', default='start=1,help=1,info=1,ping=5,health=1',
+                        help="command weights, e.g. ping=5,start=1")
+    parser.add_argument('--port', type=int, default=8081, help="fake Bot API port")
+    parser.add_argument('--report-interval', type=float, default=1.0)
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help="seconds to wait for outstanding replies after the load stops")
+    parser.add_argument('--broadcast', type=int, default=0,
+                        help="instead of updates, seed this many subscribers and measure one broadcast")
+    parser.add_argument('--inject-429', type=float, default=0.0,
+                        help="with --broadcast: probability that a sendMessage opens a flood-control window")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after seconds of injected 429s")
+    parser.add_argument('--json', help="write the summary and timeline to this file")
+    args = parser.parse_args()
+
+    if not AIOHTTP_AVAILABLE:
+        print("❌ aiohttp не установлен - установите зависимости:")
+        print("   pip install -r requirements.txt")
+        sys.exit(1)
+
+    if args.broadcast and args.bots > 1:
+        sys.exit("--broadcast supports a single bot")
+    if args.inject_429 and not args.broadcast:
+        sys.exit("--inject-429 requires --broadcast")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.broadcast:
+        os.environ['ENABLE_NOTIFICATIONS'] = 'true'
+        # Отдельный префикс, чтобы не смешивать тестовых подписчиков с настоящими
+        os.environ['CACHE_REDIS_PREFIX'] = f'load_test:{os.getpid()}:'
+        args.broadcast_rate = float(os.environ.get('NOTIFICATIONS_RATE_PER_SECOND') or 25.0)
+    os.environ['TELEGRAM_API_BASE_URL'] = f'http://127.0.0.1:{args.port}/bot'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.bots > 1:
+        os.environ['BOT_MODE'] = 'multi'
+        for i in range(args.bots):
+            os.environ[f'BOTS__LOAD{i}__TELEGRAM_BOT_TOKEN'] = TOKEN_TEMPLATE.format(index=i)
+    else:
+        os.environ['TELEGRAM_BOT_TOKEN'] = TOKEN_TEMPLATE.format(index=0)
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    api_process = multiprocessing.Process(target=run_fake_api, args=(args, child_conn), daemon=True)
+    api_process.start()
+    if parent_conn.recv()['event'] != 'ready':
+        sys.exit("Fake Bot API failed to start")
+
+    try:
+        summary = asyncio.run(drive_bot(args, parent_conn))
+    finally:
+        api_process.terminate()
+        api_process.join(timeout=5)
+
+    print("\n📊 Итоги нагрузочного теста")
+    broadcast = summary['broadcast']
+    if broadcast:
+        rate, steady = broadcast['messages_per_second'], broadcast['steady_messages_per_second']
+        print(f"   Рассылка: {broadcast['delivered']}/{broadcast['subscribers']} доставлено "
+              f"(очередь: {broadcast['store']})")
+        print(f"   Скорость, msg/s: средняя={rate if rate is not None else float('nan'):.1f} "
+              f"после burst={steady if steady is not None else float('nan'):.1f} "
+              f"лимит={broadcast['rate_limit_per_second']:g}")
+        scheduler = broadcast['scheduler']
+        print(f"   Планировщик: failed={scheduler['failed']} retried={scheduler['retried']} "
+              f"throttled={scheduler['throttled']}")
+        if args.inject_429:
+            excluding = broadcast['steady_excluding_flood']
+            print(f"   Flood control: {broadcast['api_throttled']} ответов 429, "
+                  f"{broadcast['flood_seconds']:.0f} s окон retry_after; скорость вне окон="
+                  f"{excluding if excluding is not None else float('nan'):.1f} msg/s")
+            checks = [
+                ("429 обработаны планировщиком", scheduler['throttled'] > 0),
+                ("все сообщения доставлены", broadcast['delivered'] - broadcast['duplicates'] == broadcast['subscribers']),
+                ("без повторной доставки", broadcast['duplicates'] == 0),
+                # Если окна покрывают всю рассылку, скорость вне окон не измерить
+                ("скорость вне окон у лимита", None if excluding is None else
+                 abs(excluding - broadcast['rate_limit_per_second']) <= 0.15 * broadcast['rate_limit_per_second']),
+            ]
+            for name, ok in checks:
+                print(f"   {'➖' if ok is None else '✅' if ok else '❌'} {name}")
+            failed_checks = any(ok is False for _, ok in checks)
+    else:
+        print(f"   Апдейтов: {summary['generated']}, ответов: {summary['replied']}, потеряно: {summary['lost']}")
+        print(f"   Пропускная способность: {summary['updates_per_second']:.1f} upd/s")
+        latency = summary['latency']
+        print(f"   Задержка ответа, ms: p50={ms(latency['p50']).strip()} p90={ms(latency['p90']).strip()} "
+              f"p99={ms(latency['p99']).strip()} max={ms(latency['max']).strip()}")
+    lag = summary['loop_lag']
+    print(f"   Event loop lag, ms: p50={ms(lag['p50']).strip()} p99={ms(lag['p99']).strip()} "
+          f"max={ms(lag['max']).strip()}")
+    rss = summary['rss_mb']
+    if rss['peak'] is not None:
+        print(f"   RSS, MB: start={rss['start']:.1f} peak={rss['peak']:.1f} end={rss['end']:.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"   JSON: {args.json}")
+    if broadcast and args.inject_429 and failed_checks:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
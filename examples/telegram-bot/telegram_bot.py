@@ -16,12 +16,26 @@ Telegram бот для Docker контейнера с Unix Secrets Manager
 Секреты загружаются через systemd credentials или Docker volumes
 """
 import os
+import io
+import csv
+import hmac
+import json
 import logging
+import mmap
+import random
 import signal
+import itertools
 import sys
+import threading
 import time
-from datetime import datetime
-from typing import Dict, Any, Optional
+import uuid
+from collections import deque
+from collections.abc import Mapping
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, Any, Optional, Callable, List, BinaryIO
+from urllib.parse import urlsplit
 import asyncio
 from contextlib import asynccontextmanager
 
@@ -36,18 +50,23 @@ except ImportError:
 # Web framework для health checks
 try:
     from fastapi import FastAPI, HTTPException
+    from fastapi.responses import JSONResponse
     import uvicorn
     FASTAPI_AVAILABLE = True
 except ImportError:
     FASTAPI_AVAILABLE = False
     FastAPI = None
     HTTPException = None
+    JSONResponse = None
     uvicorn = None
 
 # Telegram bot
 try:
     from telegram import Update
     from telegram.ext import Application, CommandHandler, ContextTypes
+    from telegram.error import (RetryAfter, Forbidden, BadRequest, NetworkError, TimedOut,
+                                ChatMigrated, TelegramError)
+    from telegram.request import BaseRequest
     TELEGRAM_AVAILABLE = True
 except ImportError:
     TELEGRAM_AVAILABLE = False
@@ -55,6 +74,17 @@ except ImportError:
     Application = None
     CommandHandler = None
     ContextTypes = None
+    RetryAfter = Forbidden = BadRequest = NetworkError = TimedOut = None
+    ChatMigrated = TelegramError = None
+    BaseRequest = object
+
+# Общий HTTP клиент
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+    aiohttp = None
 
 # Monitoring
 try:
@@ -71,9 +101,138 @@ try:
 except ImportError:
     DB_AVAILABLE = False
 
+class SecretAuditLog:
+    """Журнал доступа к секретам: кто, что, откуда и когда читал
+
+    record() агрегирует повторные чтения сразу: счетчик в словаре по ключу
+    (секрет, источник, код вызывающего, f_lasti) обновляется за O(1) без
+    ввода-вывода. Поэтому буфер ограничивает число различных мест чтения, а
+    не число чтений: горячий цикл занимает одну запись. Фоновый writer
+    дописывает счетчики в append-only файл (JSON lines) либо в логгер
+    secrets.audit (stdout -> journald). Чтения из новых мест при заполненном
+    словаре не сохраняются (счетчик dropped).
+    """
+
+    def __init__(self, max_buffer: int = 4096, flush_interval: float = 5.0,
+                 path: Optional[str] = None):
+        self.flush_interval = flush_interval
+        self.path = path
+        self.max_buffer = max_buffer
+        self._pending: Dict[tuple, list] = {}
+        self._logger = logging.getLogger('secrets.audit')
+        self.stats = {'recorded': 0, 'written': 0, 'aggregated': 0, 'dropped': 0, 'failed': 0, 'flushes': 0}
+
+    def resize(self, max_buffer: int):
+        """Изменить предел числа различных мест чтения (накопленное сохраняется)"""
+        self.max_buffer = max_buffer
+
+    def record(self, name: str, source: Optional[str], depth: int = 2):
+        """Зафиксировать чтение секрета (без ввода-вывода и форматирования строк)
+
+        depth - глубина вызывающего кода относительно record(): фиксированная
+        глубина дешевле обхода f_back, который материализует объекты всех кадров.
+        """
+        frame = sys._getframe(depth)
+        # Имя и строка вызывающего кода вычисляются при сбросе: f_lineno в 3.11+
+        # декодирует таблицу строк, а смещение f_lasti читается бесплатно.
+        # id(code) стабилен, пока запись держит ссылку на объект кода
+        code = frame.f_code
+        key = (name, source, id(code), frame.f_lasti)
+        now = time.time()
+        self.stats['recorded'] += 1
+        # Без блокировок: record() вызывается и из потоков (asyncio.to_thread),
+        # а dict.setdefault и next(itertools.count) атомарны под GIL
+        entry = self._pending.get(key)
+        if entry is None:
+            if len(self._pending) >= self.max_buffer:
+                self.stats['dropped'] += 1
+                return
+            entry = self._pending.setdefault(key, [itertools.count(1), now, now, code])
+        entry[2] = now
+        next(entry[0])
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        """Забрать накопленные счетчики и свести их по строкам вызывающего кода"""
+        # Подмена словаря атомарна; чтение, успевшее взять запись старого
+        # словаря до подмены, но увеличившее счетчик после сброса, теряется
+        pending, self._pending = self._pending, {}
+
+        # Несколько вызовов на одной строке дают разные f_lasti - сводим по строке
+        callers: Dict[tuple, Dict[str, Any]] = {}
+        for (name, source, _, lasti), (counter, first, last, code) in pending.items():
+            # count(1) после n вызовов next() возвращает n + 1
+            count = next(counter) - 1
+            qualname = getattr(code, 'co_qualname', code.co_name)
+            lineno = next((line for start, end, line in code.co_lines() if start <= lasti < end),
+                          code.co_firstlineno)
+            caller = f"{os.path.basename(code.co_filename)}:{qualname}:{lineno}"
+            record = callers.get((name, source, caller))
+            if record is None:
+                callers[(name, source, caller)] = {
+                    'first': first, 'last': last, 'secret': name, 'source': source,
+                    'caller': caller, 'count': count,
+                }
+            else:
+                record['count'] += count
+                record['first'] = min(record['first'], first)
+                record['last'] = max(record['last'], last)
+
+        pid = os.getpid()
+        records = []
+        for record in callers.values():
+            first, last = record.pop('first'), record.pop('last')
+            records.append({
+                'ts': datetime.fromtimestamp(last, timezone.utc).isoformat(),
+                'first_ts': datetime.fromtimestamp(first, timezone.utc).isoformat(),
+                **record,
+                'pid': pid,
+            })
+        return records
+
+    def _write(self, records: List[Dict[str, Any]]):
+        lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        if self.path:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, lines.encode())
+            finally:
+                os.close(fd)
+        else:
+            for line in lines.splitlines():
+                self._logger.info(line)
+
+    async def flush(self) -> int:
+        """Сбросить агрегированные записи в журнал"""
+        records = self._drain()
+        if not records:
+            return 0
+        try:
+            await asyncio.to_thread(self._write, records)
+        except Exception as e:
+            self.stats['failed'] += len(records)
+            logging.warning(f"Secrets audit batch of {len(records)} records lost: {e}")
+            return 0
+        self.stats['written'] += len(records)
+        self.stats['aggregated'] += sum(record['count'] for record in records)
+        self.stats['flushes'] += 1
+        return len(records)
+
+    async def run(self):
+        """Фоновый writer (record() может вызываться из потоков, поэтому сброс только по таймеру)"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, 'buffered': len(self._pending), 'max_buffer': self.max_buffer,
+                'sink': self.path or 'journald'}
+
 class SecretsManager:
     """Менеджер секретов для Docker контейнера с поддержкой Unix Secrets Manager"""
 
+    # Секреты крупнее этого размера лучше читать через open_secret/get_secret_bytes
+    LARGE_SECRET_BYTES = 1024 * 1024
+
     def __init__(self):
         # Приоритеты источников секретов
         self.sources = [
@@ -85,6 +244,13 @@ class SecretsManager:
             os.environ
         ]
         self._secrets_cache: Dict[str, str] = {}
+        # path -> (st_ino, st_mtime_ns, mmap); ротация секрета меняет inode/mtime
+        self._mapped: Dict[str, tuple] = {}
+        # Откуда загружен закэшированный секрет (для журнала доступа)
+        self._secret_origins: Dict[str, str] = {}
+        self.audit = SecretAuditLog()
+        # Назначается BotInfrastructure; до этого загрузка секретов не трассируется
+        self.tracer: Optional['Tracer'] = None
         self._load_strategies = {
             'file': self._load_from_file,
             'env': self._load_from_env
@@ -106,7 +272,7 @@ class SecretsManager:
                                 for file in files[:3]:  # только первые 3
                                     try:
                                         with open(os.path.join(source, file), 'r') as f:
-                                            content = f.read().strip()
+                                            content = f.read(20).strip()
                                             print(f"  {file}: {content[:20]}...")
                                     except Exception as e:
                                         print(f"  {file}: ERROR reading - {e}")
@@ -126,36 +292,24 @@ class SecretsManager:
         if os.path.exists(secret_file):
             try:
                 with open(secret_file, 'r') as f:
+                    if os.fstat(f.fileno()).st_size > self.LARGE_SECRET_BYTES:
+                        logging.warning(f"Secret file {secret_file} is large, "
+                                        f"consider open_secret()/get_secret_bytes()")
                     return f.read().strip()
             except Exception as e:
                 logging.warning(f"Error reading secret file {secret_file}: {e}")
         return None
 
     def _load_from_env(self, source: Dict[str, str], name: str) -> Optional[str]:
-        """Загрузить секрет из переменных окружения"""
-        env_name = name.upper().replace('-', '_')
+        """Загрузить секрет из переменных окружения (bots/shop/telegram-bot-token -> BOTS__SHOP__TELEGRAM_BOT_TOKEN)"""
+        env_name = name.upper().replace('-', '_').replace('/', '__')
         return source.get(env_name)
 
     def get_secret(self, name: str, required: bool = True) -> Optional[str]:
         """Получить секрет по имени"""
-        if name in self._secrets_cache:
-            return self._secrets_cache[name]
-
-        for source in self.sources:
-            if isinstance(source, str) and os.path.isdir(source):
-                # Источник - директория с файлами
-                secret = self._load_from_file(source, name)
-                if secret is not None:
-                    self._secrets_cache[name] = secret
-                    logging.debug(f"Loaded secret '{name}' from file in {source}")
-                    return secret
-            elif isinstance(source, dict):
-                # Источник - переменные окружения
-                secret = self._load_from_env(source, name)
-                if secret is not None:
-                    self._secrets_cache[name] = secret
-                    logging.debug(f"Loaded secret '{name}' from environment")
-                    return secret
+        secret = self._lookup(name, 3)
+        if secret is not None:
+            return secret
 
         if required:
             raise ValueError(f"Required secret '{name}' not found in any source")
@@ -168,6 +322,111 @@ class SecretsManager:
 
         return None
 
+    def _lookup(self, name: str, depth: int = 3) -> Optional[str]:
+        """Найти секрет в кэше или источниках без логирования отсутствия
+
+        depth - глубина кода, читающего секрет, для журнала доступа
+        (record <- _lookup <- get_secret <- вызывающий код).
+        """
+        if name in self._secrets_cache:
+            self.audit.record(name, self._secret_origins.get(name), depth)
+            return self._secrets_cache[name]
+
+        # Чтение из источников (промах кэша) попадает в трассировку как отдельный интервал
+        with self.tracer.span('secret.load', secret=name) if self.tracer else NOOP_SPAN:
+            for source in self.sources:
+                if isinstance(source, str) and os.path.isdir(source):
+                    # Источник - директория с файлами
+                    secret = self._load_from_file(source, name)
+                    if secret is not None:
+                        self._secrets_cache[name] = secret
+                        self._secret_origins[name] = source
+                        self.audit.record(name, source, depth)
+                        logging.debug(f"Loaded secret '{name}' from file in {source}")
+                        return secret
+                elif isinstance(source, Mapping):
+                    # Источник - переменные окружения
+                    secret = self._load_from_env(source, name)
+                    if secret is not None:
+                        self._secrets_cache[name] = secret
+                        self._secret_origins[name] = 'env'
+                        self.audit.record(name, 'env', depth)
+                        logging.debug(f"Loaded secret '{name}' from environment")
+                        return secret
+
+        return None
+
+    def get_secret_path(self, name: str) -> Optional[str]:
+        """Путь к файлу секрета в файловых источниках (None для переменных окружения)"""
+        for source in self.sources:
+            if isinstance(source, str) and os.path.isfile(os.path.join(source, name)):
+                return os.path.join(source, name)
+        return None
+
+    def open_secret(self, name: str, required: bool = True) -> Optional[BinaryIO]:
+        """Открыть секрет как бинарный поток без загрузки целиком в память
+
+        Файловые секреты открываются напрямую, значения из окружения
+        оборачиваются в BytesIO. Закрытие потока - на вызывающей стороне.
+        """
+        path = self.get_secret_path(name)
+        if path is not None:
+            self.audit.record(name, os.path.dirname(path))
+            return open(path, 'rb')
+
+        secret = self._lookup(name, 3)
+        if secret is None:
+            # Исключение или предупреждение об отсутствии секрета
+            return self.get_secret(name, required)
+        return io.BytesIO(secret.encode())
+
+    def get_secret_bytes(self, name: str, required: bool = True) -> Optional[memoryview]:
+        """Секрет как read-only memoryview без копирования
+
+        Файл отображается в память (mmap) и кэшируется до ротации: смена
+        inode или mtime файла приводит к повторному отображению.
+        """
+        path = self.get_secret_path(name)
+        if path is None:
+            secret = self._lookup(name, 3)
+            if secret is None:
+                return self.get_secret(name, required)
+            return memoryview(secret.encode())
+
+        self.audit.record(name, os.path.dirname(path))
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            cached = self._mapped.get(path)
+            if cached is not None and cached[:2] == (stat.st_ino, stat.st_mtime_ns):
+                return memoryview(cached[2])
+            if stat.st_size == 0:
+                # mmap не отображает пустые файлы
+                return memoryview(b'')
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Старое отображение не закрываем: на него могут ссылаться выданные memoryview
+        self._mapped[path] = (stat.st_ino, stat.st_mtime_ns, mapped)
+        logging.debug(f"Mapped secret '{name}' ({stat.st_size} bytes) from {path}")
+        return memoryview(mapped)
+
+    def list_namespaces(self, prefix: str) -> List[str]:
+        """Имена вложенных пространств секретов: <source>/bots/<name>/ или BOTS__<NAME>__*"""
+        names = set()
+        for source in self.sources:
+            if isinstance(source, str) and os.path.isdir(os.path.join(source, prefix)):
+                base = os.path.join(source, prefix)
+                names.update(entry for entry in os.listdir(base) if os.path.isdir(os.path.join(base, entry)))
+            elif isinstance(source, Mapping):
+                env_prefix = prefix.upper().replace('-', '_').replace('/', '__') + '__'
+                for key in source:
+                    if key.startswith(env_prefix) and '__' in key[len(env_prefix):]:
+                        names.add(key[len(env_prefix):].split('__', 1)[0].lower())
+        return sorted(names)
+
+    def namespace(self, namespace: str) -> 'SecretsNamespace':
+        """Представление секретов с префиксом namespace и fallback на общие секреты"""
+        return SecretsNamespace(self, namespace)
+
     def get_config(self) -> Dict[str, Any]:
         """Загрузить всю конфигурацию из секретов"""
         config = {}
@@ -179,6 +438,7 @@ class SecretsManager:
             'telegram_bot_username': ('telegram-bot-username', str),
             'telegram_webhook_url': ('telegram-webhook-url', str),
             'telegram_webhook_secret': ('telegram-webhook-secret', str),
+            'telegram_api_base_url': ('telegram-api-base-url', str),
 
             # Database
             'database_url': ('database-url', str),
@@ -197,6 +457,7 @@ class SecretsManager:
             'redis_port': ('redis-port', int),
             'redis_db': ('redis-db', int),
             'redis_password': ('redis-password', str),
+            'redis_connection_timeout': ('redis-connection-timeout', int),
 
             # API Keys
             'openai_api_key': ('openai-api-key', str),
@@ -209,13 +470,24 @@ class SecretsManager:
             # Monitoring
             'sentry_dsn': ('sentry-dsn', str),
             'log_level': ('log-level', str),
+            'secrets_audit_log_path': ('secrets-audit-log-path', str),
+            'secrets_audit_buffer_size': ('secrets-audit-buffer-size', int),
+            'secrets_audit_flush_interval_seconds': ('secrets-audit-flush-interval-seconds', float),
+            'tracing_cpu_budget_percent': ('tracing-cpu-budget-percent', float),
+            'tracing_sample_rate': ('tracing-sample-rate', float),
+            'tracing_slow_threshold_ms': ('tracing-slow-threshold-ms', float),
+            'tracing_export_path': ('tracing-export-path', str),
             'health_check_token': ('health-check-token', str),
+            'broadcast_token': ('broadcast-token', str),
+            'broadcast_admin_chat_ids': ('broadcast-admin-chat-ids',
+                                         lambda x: {int(chat_id) for chat_id in x.split(',') if chat_id.strip()}),
 
             # Feature Flags
             'enable_analytics': ('enable-analytics', lambda x: x.lower() == 'true'),
             'enable_notifications': ('enable-notifications', lambda x: x.lower() == 'true'),
             'enable_cache': ('enable-cache', lambda x: x.lower() == 'true'),
             'enable_rate_limiting': ('enable-rate-limiting', lambda x: x.lower() == 'true'),
+            'enable_tracing': ('enable-tracing', lambda x: x.lower() == 'true'),
 
             # Cache Configuration
             'cache_ttl_seconds': ('cache-ttl-seconds', int),
@@ -227,9 +499,21 @@ class SecretsManager:
             'rate_limit_burst_size': ('rate-limit-burst-size', int),
             'rate_limit_window_seconds': ('rate-limit-window-seconds', int),
 
+            # Analytics
+            'analytics_buffer_size': ('analytics-buffer-size', int),
+            'analytics_flush_interval_seconds': ('analytics-flush-interval-seconds', float),
+
+            # Notifications
+            'notifications_rate_per_second': ('notifications-rate-per-second', float),
+            'notifications_per_chat_interval_seconds': ('notifications-per-chat-interval-seconds', float),
+
             # Performance
             'max_concurrent_requests': ('max-concurrent-requests', int),
             'request_timeout_seconds': ('request-timeout-seconds', int),
+            'http_pool_size': ('http-pool-size', int),
+            'http_pool_per_host': ('http-pool-per-host', int),
+            'http_keepalive_seconds': ('http-keepalive-seconds', float),
+            'http_dns_cache_ttl_seconds': ('http-dns-cache-ttl-seconds', int),
             'memory_limit_mb': ('memory-limit-mb', int),
             'cpu_limit': ('cpu-limit', float),
         }
@@ -255,15 +539,23 @@ class SecretsManager:
             'database_port': 5432,
             'redis_port': 6379,
             'redis_db': 0,
+            'database_connection_timeout': 5,
+            'redis_connection_timeout': 5,
 
             # Logging
             'log_level': 'INFO',
+            'secrets_audit_buffer_size': 4096,
+            'secrets_audit_flush_interval_seconds': 5.0,
+            'tracing_cpu_budget_percent': 1.0,
+            'tracing_sample_rate': 0.05,
+            'tracing_slow_threshold_ms': 500.0,
 
             # Feature Flags
             'enable_analytics': False,
             'enable_notifications': False,
             'enable_cache': True,
             'enable_rate_limiting': True,
+            'enable_tracing': False,
 
             # Cache
             'cache_ttl_seconds': 3600,
@@ -275,58 +567,1394 @@ class SecretsManager:
             'rate_limit_burst_size': 10,
             'rate_limit_window_seconds': 60,
 
+            # Analytics
+            'analytics_buffer_size': 10000,
+            'analytics_flush_interval_seconds': 2.0,
+
+            # Notifications (лимит Telegram - около 30 сообщений в секунду на бота)
+            'notifications_rate_per_second': 25.0,
+            'notifications_per_chat_interval_seconds': 1.0,
+
             # Performance
             'max_concurrent_requests': 100,
             'request_timeout_seconds': 30,
+            'http_pool_size': 100,
+            'http_pool_per_host': 50,
+            'http_keepalive_seconds': 30.0,
+            'http_dns_cache_ttl_seconds': 300,
             'memory_limit_mb': 512,
             'cpu_limit': 1.0,
         }
         return defaults.get(key)
 
+    def trim_cache(self, keep_fraction: float):
+        """Сократить кэш секретов (при нехватке памяти секреты перечитываются из tmpfs)"""
+        keep = int(len(self._secrets_cache) * max(0.0, min(1.0, keep_fraction)))
+        for name in list(self._secrets_cache)[keep:]:
+            del self._secrets_cache[name]
+            self._secret_origins.pop(name, None)
+        keep = int(len(self._mapped) * max(0.0, min(1.0, keep_fraction)))
+        for path in list(self._mapped)[keep:]:
+            del self._mapped[path]
+
+class SecretsNamespace(SecretsManager):
+    """Секреты одного бота: сначала <namespace>/<name>, затем общий <name>
+
+    Кэш и источники общие с родительским SecretsManager. Секреты из
+    NAMESPACE_ONLY берутся только из пространства бота.
+    """
+
+    # Общий токен у нескольких ботов дал бы Conflict в getUpdates
+    NAMESPACE_ONLY = frozenset({'telegram-bot-token'})
+
+    def __init__(self, parent: SecretsManager, namespace: str):
+        # Состояние общее с родителем, поэтому SecretsManager.__init__ не вызываем
+        self.parent = parent
+        self.namespace = namespace.strip('/')
+        self.sources = parent.sources
+        self._secrets_cache = parent._secrets_cache
+        self._mapped = parent._mapped
+        self._secret_origins = parent._secret_origins
+        self._load_strategies = parent._load_strategies
+        self.audit = parent.audit
+
+    @property
+    def tracer(self) -> Optional['Tracer']:
+        # BotInfrastructure назначает трассировщик родителю уже после создания пространств
+        return self.parent.tracer
+
+    @tracer.setter
+    def tracer(self, tracer: Optional['Tracer']):
+        self.parent.tracer = tracer
+
+    def _lookup(self, name: str, depth: int = 3) -> Optional[str]:
+        secret = self.parent._lookup(f'{self.namespace}/{name}', depth + 1)
+        if secret is not None or name in self.NAMESPACE_ONLY:
+            return secret
+        return self.parent._lookup(name, depth + 1)
+
+    def get_secret_path(self, name: str) -> Optional[str]:
+        path = self.parent.get_secret_path(f'{self.namespace}/{name}')
+        if path is not None or name in self.NAMESPACE_ONLY:
+            return path
+        return self.parent.get_secret_path(name)
+
+    def trim_cache(self, keep_fraction: float):
+        self.parent.trim_cache(keep_fraction)
+
+
+# Приоритеты работы для admission control
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+class ConcurrencyLimiter:
+    """Ограничитель параллельных запросов с изменяемым лимитом"""
+
+    def __init__(self, limit: int):
+        self._limit = max(1, limit)
+        self._active = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def set_limit(self, limit: int):
+        """Изменить лимит; ожидающие задачи будут разбужены при следующем release"""
+        self._limit = max(1, limit)
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+class ResourceGovernor:
+    """Адаптивный контроль нагрузки по memory_limit_mb и cpu_limit
+
+    Память может перевести процесс в critical (и снять readiness), CPU -
+    только в elevated: короткие пики CPU не должны выводить под из
+    балансировки, достаточно отклонять низкоприоритетную работу. Кэши и
+    буферы сокращаются только под давлением памяти.
+    """
+
+    LEVEL_NORMAL = 'normal'
+    LEVEL_ELEVATED = 'elevated'
+    LEVEL_CRITICAL = 'critical'
+
+    # Доля кэшей, которую сохраняем на каждом уровне
+    CACHE_KEEP = {LEVEL_NORMAL: 1.0, LEVEL_ELEVATED: 0.5, LEVEL_CRITICAL: 0.0}
+    # Доля max_concurrent_requests на каждом уровне
+    CONCURRENCY_SCALE = {LEVEL_NORMAL: 1.0, LEVEL_ELEVATED: 0.5, LEVEL_CRITICAL: 0.25}
+    # Минимальный приоритет, который принимается на каждом уровне
+    MIN_PRIORITY = {LEVEL_NORMAL: PRIORITY_LOW, LEVEL_ELEVATED: PRIORITY_NORMAL, LEVEL_CRITICAL: PRIORITY_HIGH}
+
+    def __init__(self, memory_limit_mb: int, cpu_limit: float, max_concurrent_requests: int,
+                 interval: float = 5.0, soft_threshold: float = 0.8, hard_threshold: float = 0.95,
+                 hysteresis: float = 0.05, cpu_smoothing: float = 0.3):
+        self.memory_limit_bytes = max(1, memory_limit_mb) * 1024 * 1024
+        self.cpu_limit = cpu_limit if cpu_limit and cpu_limit > 0 else 1.0
+        self.max_concurrent_requests = max(1, max_concurrent_requests)
+        self.interval = interval
+        self.soft_threshold = soft_threshold
+        self.hard_threshold = hard_threshold
+        self.hysteresis = hysteresis
+        # Вес нового замера в EWMA загрузки CPU
+        self.cpu_smoothing = cpu_smoothing
+
+        self.limiter = ConcurrencyLimiter(self.max_concurrent_requests)
+        self.level = self.LEVEL_NORMAL
+        # Уровень только по памяти: от него зависят сокращение кэшей и readiness
+        self.memory_level = self.LEVEL_NORMAL
+        self.rss_bytes: Optional[int] = None
+        self.cpu_cores: Optional[float] = None
+        self.rejected: Dict[int, int] = {PRIORITY_LOW: 0, PRIORITY_NORMAL: 0, PRIORITY_HIGH: 0}
+        self.source = 'psutil' if PSUTIL_AVAILABLE else 'cgroup'
+
+        self._caches: Dict[str, Callable[[float], None]] = {}
+        self._process = psutil.Process() if PSUTIL_AVAILABLE else None
+        self._last_cpu: Optional[tuple] = None
+
+        # Базовая точка для CPU: первый замер в run() делается через interval
+        if self._process is not None:
+            # Первый вызов cpu_percent всегда возвращает 0.0 - инициализируем счетчик
+            self._process.cpu_percent(None)
+        else:
+            cpu_seconds = self._read_cgroup_cpu_seconds()
+            self._last_cpu = (cpu_seconds, time.monotonic()) if cpu_seconds is not None else None
+
+    @property
+    def ready(self) -> bool:
+        """Готовность принимать трафик (liveness не затрагивается)"""
+        return self.level != self.LEVEL_CRITICAL
+
+    @property
+    def background_allowed(self) -> bool:
+        """Можно ли выполнять фоновую низкоприоритетную работу (рассылки, сброс аналитики)"""
+        return self.level == self.LEVEL_NORMAL
+
+    def register_cache(self, name: str, shrink: Callable[[float], None]):
+        """Зарегистрировать кэш или буфер; shrink(keep_fraction) вызывается под давлением памяти"""
+        self._caches[name] = shrink
+
+    def admit(self, priority: int = PRIORITY_NORMAL) -> bool:
+        """Решить, принимать ли работу с данным приоритетом"""
+        if priority >= self.MIN_PRIORITY[self.level]:
+            return True
+        self.rejected[priority] = self.rejected.get(priority, 0) + 1
+        return False
+
+    def _read_cgroup_memory(self) -> Optional[int]:
+        """Текущее потребление памяти из cgroup v2/v1"""
+        for path in ('/sys/fs/cgroup/memory.current',
+                     '/sys/fs/cgroup/memory/memory.usage_in_bytes'):
+            try:
+                with open(path, 'r') as f:
+                    return int(f.read().strip())
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def _read_cgroup_cpu_seconds(self) -> Optional[float]:
+        """Суммарное CPU-время cgroup в секундах"""
+        try:
+            with open('/sys/fs/cgroup/cpu.stat', 'r') as f:
+                for line in f:
+                    if line.startswith('usage_usec'):
+                        return int(line.split()[1]) / 1_000_000
+        except (OSError, ValueError):
+            pass
+        try:
+            with open('/sys/fs/cgroup/cpuacct/cpuacct.usage', 'r') as f:
+                return int(f.read().strip()) / 1_000_000_000
+        except (OSError, ValueError):
+            return None
+
+    def sample(self):
+        """Снять текущие RSS и загрузку CPU (в ядрах, сглаженную EWMA)"""
+        cpu_cores = None
+        if self._process is not None:
+            try:
+                self.rss_bytes = self._process.memory_info().rss
+                cpu_cores = self._process.cpu_percent(None) / 100.0
+            except Exception as e:
+                logging.warning(f"psutil sampling failed, falling back to cgroup: {e}")
+                self._process = None
+                self.source = 'cgroup'
+
+        if self._process is None:
+            self.rss_bytes = self._read_cgroup_memory()
+            cpu_seconds = self._read_cgroup_cpu_seconds()
+            now = time.monotonic()
+            if cpu_seconds is not None and self._last_cpu is not None:
+                prev_cpu, prev_time = self._last_cpu
+                elapsed = now - prev_time
+                cpu_cores = (cpu_seconds - prev_cpu) / elapsed if elapsed > 0 else None
+            self._last_cpu = (cpu_seconds, now) if cpu_seconds is not None else None
+
+        if cpu_cores is not None:
+            if self.cpu_cores is None:
+                self.cpu_cores = cpu_cores
+            else:
+                self.cpu_cores += self.cpu_smoothing * (cpu_cores - self.cpu_cores)
+
+    def memory_pressure(self) -> float:
+        """Доля использования лимита памяти"""
+        return self.rss_bytes / self.memory_limit_bytes if self.rss_bytes is not None else 0.0
+
+    def cpu_pressure(self) -> float:
+        """Доля использования лимита CPU (по сглаженной загрузке)"""
+        return self.cpu_cores / self.cpu_limit if self.cpu_cores is not None else 0.0
+
+    def pressure(self) -> float:
+        """Наибольшая доля использования лимитов памяти и CPU"""
+        return max(self.memory_pressure(), self.cpu_pressure())
+
+    def _level_for(self, pressure: float, current: str) -> str:
+        """Уровень с гистерезисом относительно current, чтобы не переключаться на каждом тике"""
+        hard, soft = self.hard_threshold, self.soft_threshold
+        if current == self.LEVEL_CRITICAL:
+            hard -= self.hysteresis
+        if current in (self.LEVEL_ELEVATED, self.LEVEL_CRITICAL):
+            soft -= self.hysteresis
+
+        if pressure >= hard:
+            return self.LEVEL_CRITICAL
+        if pressure >= soft:
+            return self.LEVEL_ELEVATED
+        return self.LEVEL_NORMAL
+
+    def evaluate(self) -> str:
+        """Пересчитать уровень и применить действия"""
+        self.memory_level = level = self._level_for(self.memory_pressure(), self.memory_level)
+        if level == self.LEVEL_NORMAL and self._level_for(self.cpu_pressure(), self.level) != self.LEVEL_NORMAL:
+            # CPU отсекает только низкоприоритетную работу и не влияет на readiness
+            level = self.LEVEL_ELEVATED
+        if level != self.level:
+            logging.warning(f"Resource pressure level changed: {self.level} -> {level} "
+                            f"(rss={self.rss_bytes}, cpu_cores={self.cpu_cores})")
+            self.level = level
+            self.limiter.set_limit(int(self.max_concurrent_requests * self.CONCURRENCY_SCALE[level]))
+
+        # Кэши сокращаем на каждом тике под давлением памяти: они могут снова
+        # вырасти. При нагрузке только на CPU сокращение лишь добавит перечитываний
+        keep = self.CACHE_KEEP[self.memory_level]
+        if keep < 1.0:
+            for name, shrink in self._caches.items():
+                try:
+                    shrink(keep)
+                except Exception as e:
+                    logging.error(f"Failed to shrink cache '{name}': {e}")
+        return level
+
+    async def run(self):
+        """Периодический опрос ресурсов"""
+        while True:
+            # Сначала ждем: загрузка CPU считается за интервал от базовой точки
+            await asyncio.sleep(self.interval)
+            try:
+                self.sample()
+                self.evaluate()
+            except Exception as e:
+                logging.error(f"Resource governor tick failed: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние для health endpoints"""
+        return {
+            "level": self.level,
+            "memory_level": self.memory_level,
+            "ready": self.ready,
+            "source": self.source,
+            "pressure": round(self.pressure(), 3),
+            "memory_pressure": round(self.memory_pressure(), 3),
+            "cpu_pressure": round(self.cpu_pressure(), 3),
+            "rss_bytes": self.rss_bytes,
+            "memory_limit_bytes": self.memory_limit_bytes,
+            "cpu_cores": self.cpu_cores,
+            "cpu_limit": self.cpu_limit,
+            "concurrency": {"limit": self.limiter.limit, "active": self.limiter.active},
+            "rejected": {
+                "low": self.rejected[PRIORITY_LOW],
+                "normal": self.rejected[PRIORITY_NORMAL],
+                "high": self.rejected[PRIORITY_HIGH],
+            },
+        }
+
+class CircuitOpenError(Exception):
+    """Зависимость недоступна: circuit breaker разомкнут"""
+
+class CircuitBreaker:
+    """Circuit breaker для внешней зависимости (closed/open/half-open с backoff)"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, critical: bool = True, failure_threshold: int = 3,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.name = name
+        self.critical = critical
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = base_backoff
+        self.open_until = 0.0
+        self.last_error: Optional[str] = None
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Можно ли обращаться к зависимости; в open - без единого системного вызова"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() < self.open_until:
+                return False
+            # Backoff истек - пропускаем одну пробную попытку
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def record_success(self):
+        """Успешный вызов замыкает цепь"""
+        if self.state != self.CLOSED:
+            logging.info(f"Circuit '{self.name}' closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self.last_error = None
+        self._trial_in_flight = False
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        """Неудачный вызов; при превышении порога цепь размыкается"""
+        self.failures += 1
+        self.last_error = (str(error) or type(error).__name__) if error else None
+        self._trial_in_flight = False
+
+        if self.state == self.HALF_OPEN:
+            # Пробная попытка не удалась - увеличиваем backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self._open()
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def release_trial(self):
+        """Вызов отменен без результата: пробная попытка в half-open снова доступна"""
+        self._trial_in_flight = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.open_until = time.monotonic() + self.backoff
+        logging.warning(f"Circuit '{self.name}' opened for {self.backoff:.1f}s: {self.last_error}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние для health endpoints"""
+        return {
+            "state": self.state,
+            "critical": self.critical,
+            "failures": self.failures,
+            "backoff_seconds": self.backoff,
+            "retry_in_seconds": max(0.0, round(self.open_until - time.monotonic(), 3)) if self.state == self.OPEN else 0.0,
+            "last_error": self.last_error,
+        }
+
+class TokenBucket:
+    """Асинхронный token bucket для глобального ограничения скорости"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов на seconds (обработка retry_after)"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class BroadcastStore:
+    """Персистентная очередь рассылок в Redis"""
+
+    def __init__(self, redis_client, prefix: str = 'telegram_bot:'):
+        self.redis = redis_client
+        self.jobs_key = f'{prefix}broadcast:jobs'
+        self.subscribers_key = f'{prefix}subscribers'
+        self.job_prefix = f'{prefix}broadcast:'
+
+    def _job_key(self, job_id: str) -> str:
+        return f'{self.job_prefix}{job_id}'
+
+    def add_subscriber(self, chat_id: int):
+        self.redis.sadd(self.subscribers_key, chat_id)
+
+    def remove_subscriber(self, chat_id: int):
+        self.redis.srem(self.subscribers_key, chat_id)
+
+    def subscribers(self) -> List[int]:
+        return [int(chat_id) for chat_id in self.redis.smembers(self.subscribers_key)]
+
+    def create_job(self, text: str, chat_ids: List[int]) -> str:
+        """Поставить рассылку в очередь"""
+        job_id = uuid.uuid4().hex
+        job_key = self._job_key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(job_key, mapping={
+            'text': text,
+            'status': 'queued',
+            'total': len(chat_ids),
+            'cursor': 0,
+            'sent': 0,
+            'failed': 0,
+            'created_at': datetime.now().isoformat(),
+        })
+        for i in range(0, len(chat_ids), 1000):
+            pipe.rpush(f'{job_key}:chats', *chat_ids[i:i + 1000])
+        pipe.rpush(self.jobs_key, job_id)
+        pipe.execute()
+        return job_id
+
+    def next_job(self) -> Optional[Dict[str, Any]]:
+        """Первая незавершенная рассылка (включая прерванную перезапуском)"""
+        job_id = self.redis.lindex(self.jobs_key, 0)
+        if job_id is None:
+            return None
+        job = self.redis.hgetall(self._job_key(job_id))
+        if not job:
+            # Хэш задачи потерян - убираем из очереди
+            self.redis.lrem(self.jobs_key, 1, job_id)
+            return None
+        job['id'] = job_id
+        return job
+
+    def get_chunk(self, job_id: str, cursor: int, size: int) -> List[int]:
+        return [int(chat_id) for chat_id in
+                self.redis.lrange(f'{self._job_key(job_id)}:chats', cursor, cursor + size - 1)]
+
+    def advance(self, job_id: str, count: int, sent: int, failed: int):
+        """Зафиксировать прогресс после обработки пакета"""
+        pipe = self.redis.pipeline()
+        job_key = self._job_key(job_id)
+        pipe.hset(job_key, 'status', 'running')
+        pipe.hincrby(job_key, 'cursor', count)
+        pipe.hincrby(job_key, 'sent', sent)
+        pipe.hincrby(job_key, 'failed', failed)
+        pipe.execute()
+
+    def finish(self, job_id: str):
+        job_key = self._job_key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(job_key, mapping={'status': 'done', 'finished_at': datetime.now().isoformat()})
+        pipe.expire(job_key, 7 * 24 * 3600)
+        pipe.delete(f'{job_key}:chats')
+        pipe.lrem(self.jobs_key, 1, job_id)
+        pipe.execute()
+
+class BroadcastScheduler:
+    """Отправка рассылок с глобальным и per-chat ограничением скорости
+
+    Прогресс фиксируется в хранилище после каждого пакета, поэтому после
+    перезапуска рассылка продолжается с последнего пакета (at-least-once).
+    Пока should_run() ложно (нехватка памяти), новые пакеты не начинаются.
+    """
+
+    def __init__(self, store: BroadcastStore, send_message: Callable, call_store: Callable,
+                 rate_per_second: float = 25.0, per_chat_interval: float = 1.0,
+                 concurrency: int = 10, chunk_size: int = 50, max_retries: int = 3,
+                 poll_interval: float = 1.0, max_chunk_attempts: int = 3, max_flood_waits: int = 20,
+                 should_run: Optional[Callable[[], bool]] = None):
+        self.store = store
+        self.send_message = send_message
+        self.call_store = call_store
+        self.bucket = TokenBucket(rate_per_second)
+        self.per_chat_interval = per_chat_interval
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        # Flood control не говорит о получателе - у ожиданий retry_after свой лимит
+        self.max_flood_waits = max_flood_waits
+        self.poll_interval = poll_interval
+        self.max_chunk_attempts = max_chunk_attempts
+        self.should_run = should_run
+        self.paused = False
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next: Dict[int, float] = {}
+        self._sent_times: deque = deque(maxlen=10000)
+        self.current_job: Optional[Dict[str, Any]] = None
+        # (job_id, cursor) -> число попыток пакета; защищает от бесконечной
+        # повторной отправки пакета, прогресс которого не удается сохранить
+        self._chunk_attempts: Dict[tuple, int] = {}
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'throttled': 0, 'migrated': 0,
+                      'chunks_skipped': 0, 'jobs_done': 0}
+
+    async def _wait_for_chat(self, chat_id: int):
+        """Соблюсти минимальный интервал между сообщениями в один чат"""
+        now = time.monotonic()
+        next_allowed = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, next_allowed) + self.per_chat_interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+        if len(self._chat_next) > 10000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+
+    async def _send(self, chat_id: int, text: str) -> bool:
+        """Отправить одно сообщение с повторами; True при успехе"""
+        attempt = flood_waits = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                async with self._semaphore:
+                    await self.send_message(chat_id, text)
+                self.stats['sent'] += 1
+                self._sent_times.append(time.monotonic())
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                retry_after = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                self.stats['throttled'] += 1
+                # Flood control действует на бота целиком - останавливаем всех отправителей
+                self.bucket.pause(retry_after)
+                flood_waits += 1
+                if flood_waits <= self.max_flood_waits:
+                    continue
+                logging.warning(f"Broadcast to {chat_id} failed: flood control persisted "
+                                f"after {flood_waits - 1} waits")
+                break
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован или чат не существует - повтор бессмыслен
+                logging.debug(f"Broadcast to {chat_id} rejected: {e}")
+                if isinstance(e, Forbidden):
+                    try:
+                        await self.call_store(self.store.remove_subscriber, chat_id)
+                    except Exception as store_error:
+                        logging.debug(f"Failed to remove subscriber {chat_id}: {store_error}")
+                break
+            except ChatMigrated as e:
+                # Группа стала супергруппой - переносим подписку и повторяем в новый чат
+                self.stats['migrated'] += 1
+                try:
+                    await self.call_store(self.store.remove_subscriber, chat_id)
+                    await self.call_store(self.store.add_subscriber, e.new_chat_id)
+                except Exception as store_error:
+                    logging.debug(f"Failed to migrate subscriber {chat_id}: {store_error}")
+                chat_id = e.new_chat_id
+            except NetworkError as e:
+                logging.debug(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                # Прочие ошибки (InvalidToken, Conflict, ...) не исправятся повтором
+                logging.warning(f"Broadcast to {chat_id} failed: {e}")
+                break
+            if attempt >= self.max_retries:
+                break
+            attempt += 1
+            self.stats['retried'] += 1
+
+        self.stats['failed'] += 1
+        return False
+
+    async def _wait_until_allowed(self):
+        """Приостановить рассылку, пока should_run() ложно"""
+        while self.should_run and not self.should_run():
+            if not self.paused:
+                logging.warning("Broadcast paused under resource pressure")
+                self.paused = True
+            await asyncio.sleep(self.poll_interval)
+        if self.paused:
+            logging.info("Broadcast resumed")
+            self.paused = False
+
+    async def _process(self, job: Dict[str, Any]):
+        job_id, text = job['id'], job['text']
+        cursor, total = int(job['cursor']), int(job['total'])
+        self.current_job = {'id': job_id, 'total': total, 'cursor': cursor}
+        logging.info(f"Broadcast {job_id}: resuming at {cursor}/{total}")
+
+        while cursor < total:
+            await self._wait_until_allowed()
+            chunk = await self.call_store(self.store.get_chunk, job_id, cursor, self.chunk_size)
+            if not chunk:
+                break
+
+            attempts = self._chunk_attempts.get((job_id, cursor), 0) + 1
+            self._chunk_attempts[(job_id, cursor)] = attempts
+            if attempts > self.max_chunk_attempts:
+                # Пакет уже отправлялся, но прогресс не сохранился - не рассылаем его снова
+                logging.error(f"Broadcast {job_id}: giving up on chunk at {cursor} after {attempts - 1} attempts")
+                self.stats['chunks_skipped'] += 1
+                self.stats['failed'] += len(chunk)
+                sent = 0
+            else:
+                results = await asyncio.gather(*(self._send(chat_id, text) for chat_id in chunk),
+                                               return_exceptions=True)
+                for result in results:
+                    if isinstance(result, Exception):
+                        logging.error(f"Broadcast {job_id}: unexpected send error: {result}")
+                        self.stats['failed'] += 1
+                sent = sum(1 for result in results if result is True)
+            await self.call_store(self.store.advance, job_id, len(chunk), sent, len(chunk) - sent)
+            self._chunk_attempts.pop((job_id, cursor), None)
+            cursor += len(chunk)
+            self.current_job['cursor'] = cursor
+
+        await self.call_store(self.store.finish, job_id)
+        self.stats['jobs_done'] += 1
+        self.current_job = None
+        logging.info(f"Broadcast {job_id}: completed")
+
+    async def run(self):
+        """Основной цикл планировщика"""
+        while True:
+            try:
+                job = await self.call_store(self.store.next_job)
+                if job is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Broadcast scheduler error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def trim(self, keep_fraction: float):
+        """Сократить служебные структуры (давление памяти); интервалы чатов в силе не трогаем"""
+        now = time.monotonic()
+        self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        for _ in range(len(self._sent_times) - int(len(self._sent_times) * keep_fraction)):
+            self._sent_times.popleft()
+        self._chunk_attempts = {k: v for k, v in self._chunk_attempts.items()
+                                if self.current_job and k[0] == self.current_job['id']}
+
+    def messages_per_second(self, window: float = 10.0) -> float:
+        """Фактическая скорость отправки за последние window секунд"""
+        cutoff = time.monotonic() - window
+        return sum(1 for t in self._sent_times if t >= cutoff) / window
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'messages_per_second': round(self.messages_per_second(), 2),
+            'rate_limit_per_second': self.bucket.rate,
+            'paused': self.paused,
+            'current_job': self.current_job,
+        }
+
+class AnalyticsRecorder:
+    """Буферизованная запись событий аналитики
+
+    record() только добавляет кортеж в deque; запись в БД делает фоновый
+    flusher пакетами по размеру или по времени. При переполнении буфера
+    новые события отбрасываются и учитываются в счетчике dropped.
+
+    Пока should_flush() ложно (перегрузка), сброс откладывается, пока буфер
+    заполнен меньше чем наполовину. stop() завершает flusher без отмены:
+    начатая запись пакета доводится до конца, затем сбрасывается остаток.
+    """
+
+    def __init__(self, write_batch: Callable[[List[tuple]], Any], max_buffer: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 2.0,
+                 should_flush: Optional[Callable[[], bool]] = None):
+        self.write_batch = write_batch
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.should_flush = should_flush
+
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self.stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    def record(self, event_type: str, chat_id: Optional[int] = None,
+               user_id: Optional[int] = None, payload: Optional[Dict[str, Any]] = None):
+        """Добавить событие в буфер (O(1), без ввода-вывода)"""
+        if len(self._buffer) >= self.max_buffer:
+            self.stats['dropped'] += 1
+            return
+        self._buffer.append((time.time(), event_type, chat_id, user_id, payload))
+        self.stats['recorded'] += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Записать все накопленные события пакетами"""
+        written = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self.write_batch(batch)
+            except Exception as e:
+                # Повторная постановка в буфер при недоступной БД переполнит его - отбрасываем
+                self.stats['failed'] += len(batch)
+                logging.warning(f"Analytics batch of {len(batch)} events dropped: {e}")
+                break
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+            written += len(batch)
+        return written
+
+    def stop(self):
+        """Попросить flusher завершиться после последнего сброса"""
+        self._stopping = True
+        self._wakeup.set()
+
+    async def run(self) -> int:
+        """Фоновый flusher; после stop() возвращает число событий последнего сброса"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            if self.should_flush and not self.should_flush() and len(self._buffer) < self.max_buffer // 2:
+                continue
+            await self.flush()
+        # Отмена посреди flush() потеряла бы извлеченный пакет, а поток с COPY
+        # продолжил бы работу - поэтому остаток сбрасывается здесь, а не снаружи
+        return await self.flush()
+
+    def trim(self, keep_fraction: float):
+        """Отбросить самые старые события сверх keep_fraction буфера (давление памяти)"""
+        excess = len(self._buffer) - int(len(self._buffer) * keep_fraction)
+        for _ in range(excess):
+            self._buffer.popleft()
+        self.stats['dropped'] += excess
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, 'buffered': len(self._buffer), 'max_buffer': self.max_buffer}
+
+# Текущая трасса и интервал (контекст копируется в задачи asyncio и asyncio.to_thread)
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+class Span:
+    """Интервал трассировки; идентификаторы назначаются только при экспорте"""
+
+    __slots__ = ('name', 'kind', 'parent', 'attributes', 'start_ns', 'end_ns', 'error')
+
+    def __init__(self, name: str, kind: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+class Trace:
+    """Трасса одного апдейта: корневой интервал и (если запись включена) дочерние"""
+
+    __slots__ = ('root', 'spans', 'recording', 'reason')
+
+    def __init__(self, root: Span, recording: bool):
+        self.root = root
+        self.spans: List[Span] = []
+        self.recording = recording
+        self.reason: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.root.end_ns - self.root.start_ns) / 1e6
+
+class _NoopScope:
+    """Контекстный менеджер для неотбираемых интервалов"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopScope()
+
+class _SpanScope:
+    __slots__ = ('span', 'token')
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.time_ns()
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        return False
+
+class _TraceScope(_SpanScope):
+    __slots__ = ('tracer', 'trace', 'trace_token')
+
+    def __init__(self, tracer: 'Tracer', trace: Trace):
+        super().__init__(trace.root)
+        self.tracer = tracer
+        self.trace = trace
+
+    def __enter__(self) -> Span:
+        self.trace_token = _current_trace.set(self.trace)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        _current_trace.reset(self.trace_token)
+        self.tracer._finish(self.trace)
+        return False
+
+class Tracer:
+    """Трассировка обработки апдейтов с адаптивной выборкой
+
+    Каждый апдейт получает корневой интервал (только замер времени). Дочерние
+    интервалы (БД, Redis, загрузка секретов) записываются для доли трасс rate,
+    которая подстраивается так, чтобы затраты на трассировку не превышали
+    cpu_budget от процессорного времени процесса; в затраты входят и корневые
+    интервалы всех апдейтов, хотя выборкой они не регулируются. Завершенные трассы
+    сохраняются по хвосту: медленные (>= slow_threshold_ms) всегда, быстрые
+    записанные - с вероятностью sample_rate. Экспорт - в фоне, пакетами.
+    """
+
+    MAX_SPANS_PER_TRACE = 256
+
+    def __init__(self, exporters: Optional[List[Any]] = None, enabled: bool = True,
+                 cpu_budget: float = 0.01, sample_rate: float = 0.05, slow_threshold_ms: float = 500.0,
+                 min_rate: float = 0.001, max_pending: int = 1000, interval: float = 5.0):
+        self.exporters = exporters or []
+        self.enabled = enabled
+        self.cpu_budget = cpu_budget
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.min_rate = min_rate
+        self.max_pending = max_pending
+        self.interval = interval
+
+        self.rate = 1.0
+        self.overhead_percent = 0.0
+        self._pending: deque = deque()
+        self._window_spans = 0
+        self._window_traces = 0
+        self.stats = {'traces': 0, 'recorded': 0, 'spans': 0, 'slow': 0, 'sampled': 0,
+                      'exported': 0, 'dropped': 0, 'failed': 0}
+        self.span_cost = self._calibrate() if enabled else 0.0
+        self.trace_cost = self._calibrate_trace() if enabled else 0.0
+
+    def _calibrate_trace(self, iterations: int = 2000) -> float:
+        """Измерить стоимость корневого интервала без записи (секунды)"""
+        rate, self.rate = self.rate, 0.0
+        try:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                with self.trace('calibration'):
+                    pass
+            elapsed = time.perf_counter() - start
+        finally:
+            self.rate = rate
+        self._window_traces = 0
+        self.stats['traces'] = 0
+        return elapsed / iterations
+
+    def _calibrate(self, iterations: int = 2000) -> float:
+        """Измерить стоимость одного дочернего интервала (секунды)"""
+        trace = Trace(Span('calibration', 'internal', None, {}), True)
+        token = _current_trace.set(trace)
+        try:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                with self.span('calibration'):
+                    pass
+            elapsed = time.perf_counter() - start
+        finally:
+            _current_trace.reset(token)
+        self._window_spans = 0
+        self.stats['spans'] = 0
+        return elapsed / iterations
+
+    def trace(self, name: str, **attributes):
+        """Корневой интервал (обработка апдейта)"""
+        if not self.enabled:
+            return NOOP_SPAN
+        recording = self.rate >= 1.0 or random.random() < self.rate
+        self.stats['traces'] += 1
+        self._window_traces += 1
+        if recording:
+            self.stats['recorded'] += 1
+        return _TraceScope(self, Trace(Span(name, 'server', None, attributes), recording))
+
+    def span(self, name: str, kind: str = 'internal', **attributes):
+        """Дочерний интервал внутри текущей трассы (no-op вне трассы или без записи)"""
+        trace = _current_trace.get()
+        if trace is None or not trace.recording or len(trace.spans) >= self.MAX_SPANS_PER_TRACE:
+            return NOOP_SPAN
+        span = Span(name, kind, _current_span.get(), attributes)
+        trace.spans.append(span)
+        self._window_spans += 1
+        self.stats['spans'] += 1
+        return _SpanScope(span)
+
+    def _finish(self, trace: Trace):
+        """Хвостовое решение о сохранении трассы"""
+        if trace.duration_ms >= self.slow_threshold_ms:
+            trace.reason = 'slow'
+        elif trace.recording and random.random() < self.sample_rate:
+            trace.reason = 'sampled'
+        else:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.stats['dropped'] += 1
+            return
+        self.stats[trace.reason] += 1
+        self._pending.append(trace)
+
+    async def flush(self) -> int:
+        """Экспортировать накопленные трассы"""
+        if not self._pending:
+            return 0
+        batch = list(self._pending)
+        self._pending.clear()
+        exported = 0
+        # Счетчики ведутся по экспортерам: трасса, отправленная в файл и в
+        # Sentry, учитывается дважды, а неудачный экспорт - только в failed
+        for exporter in self.exporters:
+            try:
+                await asyncio.to_thread(exporter.export, batch)
+            except Exception as e:
+                self.stats['failed'] += len(batch)
+                logging.warning(f"Trace export to {type(exporter).__name__} failed: {e}")
+                continue
+            self.stats['exported'] += len(batch)
+            exported += len(batch)
+        return exported
+
+    def trim(self, keep_fraction: float):
+        """Отбросить самые старые трассы, ожидающие экспорта (давление памяти)"""
+        excess = len(self._pending) - int(len(self._pending) * keep_fraction)
+        for _ in range(excess):
+            self._pending.popleft()
+        self.stats['dropped'] += excess
+
+    def _adapt(self, cpu_seconds: float, export_seconds: float):
+        """Подстроить долю записываемых трасс под бюджет CPU за прошедшее окно"""
+        # Корневой интервал создается для каждого апдейта независимо от rate
+        overhead = self._window_traces * self.trace_cost + self._window_spans * self.span_cost + export_seconds
+        self._window_spans = 0
+        self._window_traces = 0
+        budget = cpu_seconds * self.cpu_budget
+        self.overhead_percent = overhead / cpu_seconds * 100 if cpu_seconds > 0 else 0.0
+        if overhead > budget:
+            self.rate = max(self.min_rate, self.rate * budget / overhead)
+        elif overhead < budget / 2:
+            self.rate = min(1.0, self.rate * 2)
+
+    async def run(self):
+        """Фоновый экспорт и адаптация выборки"""
+        cpu_mark = time.process_time()
+        while True:
+            await asyncio.sleep(self.interval)
+            started = time.process_time()
+            await self.flush()
+            now = time.process_time()
+            self._adapt(now - cpu_mark, now - started)
+            cpu_mark = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'rate': round(self.rate, 4),
+            'overhead_percent': round(self.overhead_percent, 3),
+            'cpu_budget_percent': self.cpu_budget * 100,
+            'span_cost_us': round(self.span_cost * 1e6, 2),
+            'trace_cost_us': round(self.trace_cost * 1e6, 2),
+            'pending': len(self._pending),
+            'exporters': [type(exporter).__name__ for exporter in self.exporters],
+        }
+
+class OTLPFileExporter:
+    """Дозапись трасс в файл в формате OTLP/JSON
+
+    Каждая строка - ExportTraceServiceRequest, как у file exporter
+    OpenTelemetry Collector; файл можно загрузить в collector или Jaeger.
+    """
+
+    KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+    def __init__(self, path: str, service_name: str = 'telegram-bot'):
+        self.path = path
+        self.service_name = service_name
+
+    @staticmethod
+    def _value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {'boolValue': value}
+        if isinstance(value, int):
+            return {'intValue': str(value)}
+        if isinstance(value, float):
+            return {'doubleValue': value}
+        return {'stringValue': str(value)}
+
+    def _attributes(self, attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [{'key': key, 'value': self._value(value)} for key, value in attributes.items()]
+
+    def _encode(self, trace: Trace) -> Dict[str, Any]:
+        trace_id = os.urandom(16).hex()
+        span_ids = {id(span): os.urandom(8).hex() for span in [trace.root, *trace.spans]}
+        spans = []
+        for span in [trace.root, *trace.spans]:
+            attributes = dict(span.attributes)
+            if span is trace.root:
+                attributes['sampling.reason'] = trace.reason
+                attributes['sampling.recorded'] = trace.recording
+            encoded = {
+                'traceId': trace_id,
+                'spanId': span_ids[id(span)],
+                'name': span.name,
+                'kind': self.KINDS.get(span.kind, 1),
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns or trace.root.end_ns),
+                'attributes': self._attributes(attributes),
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+            }
+            if span.parent is not None and id(span.parent) in span_ids:
+                encoded['parentSpanId'] = span_ids[id(span.parent)]
+            spans.append(encoded)
+        return {'resourceSpans': [{
+            'resource': {'attributes': self._attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': 'telegram_bot'}, 'spans': spans}],
+        }]}
+
+    def export(self, traces: List[Trace]):
+        lines = ''.join(json.dumps(self._encode(trace), ensure_ascii=False) + '\n' for trace in traces)
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+class SentryTraceExporter:
+    """Отправка отобранных трасс в Sentry как транзакций с дочерними интервалами"""
+
+    @staticmethod
+    def _timestamp(ns: int) -> datetime:
+        return datetime.fromtimestamp(ns / 1e9, timezone.utc)
+
+    def export(self, traces: List[Trace]):
+        for trace in traces:
+            root = trace.root
+            transaction = sentry_sdk.start_transaction(
+                name=root.name, op='telegram.update',
+                start_timestamp=self._timestamp(root.start_ns),
+                custom_sampling_context={'bot_tracer': True}
+            )
+            transaction.set_tag('sampling.reason', trace.reason)
+            for key, value in root.attributes.items():
+                transaction.set_data(key, value)
+
+            # Родитель создается раньше потомков, поэтому обход в порядке записи корректен
+            sentry_spans = {id(root): transaction}
+            for span in trace.spans:
+                parent = sentry_spans.get(id(span.parent), transaction)
+                child = parent.start_child(op=span.name, description=span.name,
+                                           start_timestamp=self._timestamp(span.start_ns))
+                for key, value in span.attributes.items():
+                    child.set_data(key, value)
+                if span.error:
+                    child.set_status('internal_error')
+                    child.set_data('error', span.error)
+                child.finish(end_timestamp=self._timestamp(span.end_ns or root.end_ns))
+                sentry_spans[id(span)] = child
+
+            transaction.set_status('internal_error' if root.error else 'ok')
+            transaction.finish(end_timestamp=self._timestamp(root.end_ns))
+
+class HttpClientPool:
+    """Общий пул исходящих HTTP-соединений для Bot API и сторонних API
+
+    Одна aiohttp.ClientSession на пул: keep-alive соединения по хостам,
+    кэш DNS, лимит соединений на хост (запросы сверх лимита ждут свободное
+    соединение в пределах connect-таймаута) и общий таймаут запроса.
+
+    Момент получения соединения от коннектора отслеживается через
+    TraceConfig aiohttp, поэтому по каждому хосту отдельно считаются запросы,
+    ожидающие соединение (waiting), и запросы на соединении (active), а
+    задержка делится на ожидание пула (wait) и ответ сервера (latency).
+    """
+
+    LATENCY_SAMPLES = 1000
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 50, timeout: Optional[float] = 30.0,
+                 keepalive: float = 30.0, dns_cache_ttl: int = 300, tracer: Optional[Tracer] = None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.dns_cache_ttl = dns_cache_ttl
+        self.tracer = tracer
+        self._session = None
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+
+    async def start(self):
+        """Создать сессию (внутри event loop; повторный вызов ничего не делает)"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_acquired)
+        trace_config.on_connection_reuseconn.append(self._on_connection_acquired)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                              trace_configs=[trace_config])
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self):
+        """Сессия aiohttp для кода, которому нужен прямой доступ (метрики не собираются)"""
+        return self._session
+
+    def _host_stats(self, host: str) -> Dict[str, Any]:
+        stats = self._hosts.get(host)
+        if stats is None:
+            stats = self._hosts[host] = {'waiting': 0, 'active': 0, 'requests': 0, 'errors': 0,
+                                         'wait': deque(maxlen=self.LATENCY_SAMPLES),
+                                         'latency': deque(maxlen=self.LATENCY_SAMPLES)}
+        return stats
+
+    @staticmethod
+    async def _on_connection_acquired(session, context, params):
+        """Коннектор выдал запросу соединение (новое или keep-alive)"""
+        state = context.trace_request_ctx
+        if not isinstance(state, dict) or state.get('acquired_at') is not None:
+            # Чужой запрос session или повторное соединение при редиректе
+            return
+        state['acquired_at'] = time.perf_counter()
+        stats = state['stats']
+        stats['waiting'] -= 1
+        stats['active'] += 1
+        stats['wait'].append(state['acquired_at'] - state['started'])
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """Выполнить запрос через пул: async with pool.request('GET', url) as response"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        host = urlsplit(url).netloc
+        stats = self._host_stats(host)
+        stats['waiting'] += 1
+        stats['requests'] += 1
+        state = {'stats': stats, 'started': time.perf_counter(), 'acquired_at': None}
+        tracer = self.tracer
+        with tracer.span(f'http.{method.lower()}', kind='client', **{'http.host': host}) if tracer else NOOP_SPAN:
+            try:
+                try:
+                    response = await self._session.request(method, url, trace_request_ctx=state, **kwargs)
+                except Exception:
+                    stats['errors'] += 1
+                    raise
+                stats['latency'].append(time.perf_counter() - (state['acquired_at'] or state['started']))
+                if response.status >= 500:
+                    stats['errors'] += 1
+                async with response:
+                    yield response
+            finally:
+                if state['acquired_at'] is None:
+                    stats['waiting'] -= 1
+                else:
+                    stats['active'] -= 1
+
+    def trim(self, keep_fraction: float):
+        """Сократить выборки задержек по хостам до последних keep_fraction (давление памяти)"""
+        for stats in self._hosts.values():
+            for key in ('wait', 'latency'):
+                samples = stats[key]
+                for _ in range(len(samples) - int(len(samples) * keep_fraction)):
+                    samples.popleft()
+
+    @staticmethod
+    def _percentiles(samples) -> Dict[str, float]:
+        samples = sorted(samples)
+        if not samples:
+            return {}
+        return {name: round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+                for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))}
+
+    def snapshot(self) -> Dict[str, Any]:
+        hosts = {}
+        for host, stats in self._hosts.items():
+            hosts[host] = {
+                'waiting': stats['waiting'],
+                'active': stats['active'],
+                # Доля лимита соединений хоста, занятая запросами (не больше 1.0)
+                'utilization': round(stats['active'] / self.limit_per_host, 3) if self.limit_per_host else None,
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'wait_ms': self._percentiles(stats['wait']),
+                'latency_ms': self._percentiles(stats['latency']),
+            }
+        active = sum(stats['active'] for stats in self._hosts.values())
+        return {
+            'started': self._session is not None and not self._session.closed,
+            'limit': self.limit,
+            'limit_per_host': self.limit_per_host,
+            'waiting': sum(stats['waiting'] for stats in self._hosts.values()),
+            'active': active,
+            'utilization': round(active / self.limit, 3) if self.limit else None,
+            'hosts': hosts,
+        }
+
+class PooledBotRequest(BaseRequest):
+    """Сетевой слой python-telegram-bot поверх общего HttpClientPool
+
+    Заменяет HTTPXRequest: запросы к Bot API всех ботов процесса идут через
+    одни keep-alive соединения. Пул принадлежит BotInfrastructure, поэтому
+    shutdown() его не закрывает.
+    """
+
+    def __init__(self, pool: HttpClientPool, read_timeout: Optional[float] = 5.0,
+                 write_timeout: Optional[float] = 5.0, connect_timeout: Optional[float] = 5.0,
+                 pool_timeout: Optional[float] = 1.0):
+        self.pool = pool
+        self._read_timeout = read_timeout
+        self._write_timeout = write_timeout
+        self._connect_timeout = connect_timeout
+        self._pool_timeout = pool_timeout
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._read_timeout
+
+    async def initialize(self):
+        await self.pool.start()
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        default = type(BaseRequest.DEFAULT_NONE)
+        if isinstance(read_timeout, default):
+            read_timeout = self._read_timeout
+        if isinstance(connect_timeout, default):
+            connect_timeout = self._connect_timeout
+        if isinstance(pool_timeout, default):
+            pool_timeout = self._pool_timeout
+
+        files = request_data.multipart_data if request_data else None
+        data = request_data.json_parameters if request_data else None
+        if files:
+            form = aiohttp.FormData()
+            for name, value in data.items():
+                form.add_field(name, value)
+            for name, (filename, content, mimetype) in files.items():
+                form.add_field(name, content, filename=filename, content_type=mimetype)
+            data = form
+
+        # В aiohttp ожидание свободного соединения пула входит в connect-таймаут;
+        # write_timeout отдельно не поддерживается
+        connect = None if connect_timeout is None or pool_timeout is None else connect_timeout + pool_timeout
+        timeout = aiohttp.ClientTimeout(total=None, connect=connect, sock_read=read_timeout)
+
+        try:
+            async with self.pool.request(method, url, data=data, timeout=timeout,
+                                         headers={'User-Agent': self.USER_AGENT}) as response:
+                return response.status, await response.read()
+        except asyncio.TimeoutError as e:
+            raise TimedOut from e
+        except aiohttp.ClientError as e:
+            raise NetworkError(f"aiohttp.{e.__class__.__name__}: {e}") from e
+
 # FastAPI приложение для health checks
 if FASTAPI_AVAILABLE:
     app = FastAPI(title="Telegram Bot Health Check")
 else:
     app = None
 
-class TelegramBot:
-    """Основной класс Telegram бота для Docker"""
+def setup_logging(config: Dict[str, Any]) -> logging.Logger:
+    """Настройка логирования для Docker"""
+    # В тестовой среде всегда DEBUG для отладки
+    if os.environ.get('ENVIRONMENT') == 'test':
+        log_level = logging.DEBUG
+    else:
+        log_level = getattr(logging, (config.get('log_level') or 'INFO').upper(), logging.INFO)
+
+    # Настройка для Docker (stdout/stderr)
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout),
+            logging.StreamHandler(sys.stderr)
+        ]
+    )
 
-    def __init__(self):
-        self.secrets = SecretsManager()
-        self.config = self.secrets.get_config()
-        self.logger = self._setup_logging()
-        self._init_sentry()
-        self._init_database()
-        self._init_cache()
-        self.application: Optional[Application] = None
-        self.running = False
+    logger = logging.getLogger(__name__)
+    logger.info("Logging initialized")
+    return logger
 
-        # Graceful shutdown
-        signal.signal(signal.SIGTERM, self._signal_handler)
-        signal.signal(signal.SIGINT, self._signal_handler)
+class BotInfrastructure:
+    """Общая инфраструктура процесса: БД, Redis, контроль нагрузки, circuit breakers, аналитика
 
-    def _setup_logging(self) -> logging.Logger:
-        """Настройка логирования для Docker"""
-        # В тестовой среде всегда DEBUG для отладки
-        if os.environ.get('ENVIRONMENT') == 'test':
-            log_level = logging.DEBUG
-        else:
-            log_level = getattr(logging, self.config.get('log_level', 'INFO').upper(), logging.INFO)
-
-        # Настройка для Docker (stdout/stderr)
-        logging.basicConfig(
-            level=log_level,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler(sys.stdout),
-                logging.StreamHandler(sys.stderr)
-            ]
-        )
+    Один экземпляр обслуживает как одиночного бота, так и всех ботов BotHost.
+    """
 
-        logger = logging.getLogger(__name__)
-        logger.info("Logging initialized")
-        return logger
+    def __init__(self, secrets: SecretsManager, config: Dict[str, Any], logger: logging.Logger):
+        self.secrets = secrets
+        self.config = config
+        self.logger = logger
+        self._init_sentry()
+        self._init_tracing()
+        self._init_database()
+        self._init_cache()
+        self._init_governor()
+        self._init_breakers()
+        self._init_analytics()
+        self._init_secrets_audit()
+        self._init_http()
+        self._background_tasks: List[asyncio.Task] = []
 
     def _init_sentry(self):
         """Инициализация Sentry для мониторинга"""
@@ -336,72 +1964,477 @@ class TelegramBot:
 
         sentry_dsn = self.config.get('sentry_dsn')
         if sentry_dsn:
+            options = {}
+            if self.config.get('enable_tracing'):
+                # Выборку делает Tracer: Sentry принимает только его транзакции,
+                # автоматическая трассировка интеграций (FastAPI и т.п.) отключена
+                options['traces_sampler'] = lambda context: 1.0 if context.get('bot_tracer') else 0.0
             sentry_sdk.init(
                 dsn=sentry_dsn,
                 environment=os.environ.get('ENVIRONMENT', 'production'),
-                release=os.environ.get('VERSION', '1.0.0')
+                release=os.environ.get('VERSION', '1.0.0'),
+                **options
             )
             self.logger.info("Sentry initialized")
         else:
             self.logger.info("Sentry DSN not configured")
 
+    def _init_tracing(self):
+        """Инициализация трассировки (enable_tracing): экспорт в файл OTLP/JSON и/или Sentry"""
+        exporters = []
+        enabled = bool(self.config.get('enable_tracing'))
+        if enabled:
+            if self.config.get('tracing_export_path'):
+                exporters.append(OTLPFileExporter(self.config['tracing_export_path']))
+            if SENTRY_AVAILABLE and self.config.get('sentry_dsn'):
+                exporters.append(SentryTraceExporter())
+            if not exporters:
+                self.logger.warning("Tracing enabled but neither tracing-export-path nor Sentry is configured")
+
+        self.tracer = Tracer(
+            exporters,
+            enabled=enabled,
+            cpu_budget=(self.config.get('tracing_cpu_budget_percent') or 1.0) / 100,
+            sample_rate=self.config.get('tracing_sample_rate') or 0.0,
+            slow_threshold_ms=self.config.get('tracing_slow_threshold_ms') or 500.0
+        )
+        self.secrets.tracer = self.tracer
+        if enabled:
+            self.logger.info(f"Tracing initialized (span cost {self.tracer.span_cost * 1e6:.2f} us, "
+                             f"trace cost {self.tracer.trace_cost * 1e6:.2f} us, "
+                             f"exporters: {[type(exporter).__name__ for exporter in exporters]})")
+
     def _init_database(self):
         """Инициализация подключения к базе данных"""
+        self.db_connection = None
         if not DB_AVAILABLE:
             self.logger.warning("Database libraries not available")
             return
 
         try:
-            # PostgreSQL connection
-            db_config = {
-                'host': self.config.get('database_host'),
-                'port': self.config.get('database_port'),
-                'database': self.config.get('database_name'),
-                'user': self.config.get('database_user'),
-                'password': self.config.get('database_password'),
-                'sslmode': self.config.get('database_ssl_mode', 'require')
-            }
-
-            self.db_connection = psycopg2.connect(**db_config)
+            self.db_connection = self._connect_database()
             self.logger.info("Database connection established")
 
         except Exception as e:
             self.logger.error(f"Database connection failed: {e}")
             self.db_connection = None
 
+    def _connect_database(self):
+        """Открыть подключение к PostgreSQL"""
+        db_config = {
+            'host': self.config.get('database_host'),
+            'port': self.config.get('database_port'),
+            'database': self.config.get('database_name'),
+            'user': self.config.get('database_user'),
+            'password': self.config.get('database_password'),
+            'sslmode': self.config.get('database_ssl_mode', 'require'),
+            # Без таймаута недоступная БД блокирует поток на время TCP-таймаута ОС
+            'connect_timeout': self.config.get('database_connection_timeout') or 5
+        }
+        return psycopg2.connect(**db_config)
+
     def _init_cache(self):
         """Инициализация Redis кэша"""
+        self.redis_client = None
         if not DB_AVAILABLE:
             self.logger.warning("Redis library not available")
             return
 
         try:
-            redis_config = {
-                'host': self.config.get('redis_host', 'localhost'),
-                'port': self.config.get('redis_port', 6379),
-                'db': self.config.get('redis_db', 0),
-                'password': self.config.get('redis_password'),
-                'decode_responses': True
-            }
-
-            self.redis_client = redis.Redis(**redis_config)
-            self.redis_client.ping()  # Test connection
+            self.redis_client = self._connect_redis()
             self.logger.info("Redis connection established")
 
         except Exception as e:
             self.logger.error(f"Redis connection failed: {e}")
             self.redis_client = None
 
+    def _connect_redis(self):
+        """Открыть подключение к Redis и проверить его"""
+        redis_config = {
+            'host': self.config.get('redis_host', 'localhost'),
+            'port': self.config.get('redis_port', 6379),
+            'db': self.config.get('redis_db', 0),
+            'password': self.config.get('redis_password'),
+            'socket_timeout': self.config.get('redis_connection_timeout') or 5,
+            'socket_connect_timeout': self.config.get('redis_connection_timeout') or 5,
+            'decode_responses': True
+        }
+        client = redis.Redis(**redis_config)
+        client.ping()  # Test connection
+        return client
+
+    def _init_governor(self):
+        """Инициализация контроля нагрузки по лимитам памяти и CPU"""
+        self.governor = ResourceGovernor(
+            memory_limit_mb=self.config.get('memory_limit_mb') or 512,
+            cpu_limit=self.config.get('cpu_limit') or 1.0,
+            max_concurrent_requests=self.config.get('max_concurrent_requests') or 100
+        )
+        self.governor.register_cache('secrets', self.secrets.trim_cache)
+        self.governor.register_cache('tracing', self.tracer.trim)
+
+    def _init_breakers(self):
+        """Circuit breakers для внешних зависимостей"""
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._probes: Dict[str, Callable[[], Any]] = {}
+        self.dependency_timeout = float(self.config.get('database_connection_timeout') or 5)
+        if not DB_AVAILABLE:
+            return
+
+        # Цепь и фоновый опрос заводятся только для настроенных зависимостей:
+        # иначе опрос стучится в host=None / localhost:6379 и бесконечно
+        # размыкает цепь, засоряя журнал
+        if self.config.get('database_host'):
+            self.breakers['database'] = CircuitBreaker('database', critical=True)
+            self._probes['database'] = self._ping_database
+        # Redis используется как кэш - его отказ деградирует бота, но не снимает readiness.
+        # Без redis-host он используется, только если локальный Redis ответил при старте
+        if self.config.get('redis_host') or self.redis_client is not None:
+            self.breakers['redis'] = CircuitBreaker('redis', critical=False)
+            self._probes['redis'] = self._ping_redis
+
+    def _init_analytics(self):
+        """Инициализация аналитики (требует enable_analytics и PostgreSQL)"""
+        self.analytics: Optional[AnalyticsRecorder] = None
+        self._analytics_task: Optional[asyncio.Task] = None
+        self._analytics_connection = None
+        # Таймаут call_dependency не останавливает поток с COPY: следующий пакет
+        # не должен начать второй COPY на том же соединении параллельно
+        self._analytics_lock = threading.Lock()
+        if not self.config.get('enable_analytics'):
+            return
+        if 'database' not in self.breakers:
+            self.logger.warning("Analytics enabled but the database is not configured "
+                                "(database-host) or its libraries are not available")
+            return
+
+        self.analytics = AnalyticsRecorder(
+            partial(self.call_dependency, 'database', self._write_analytics_batch),
+            max_buffer=self.config.get('analytics_buffer_size') or 10000,
+            flush_interval=self.config.get('analytics_flush_interval_seconds') or 2.0,
+            should_flush=lambda: self.governor.background_allowed
+        )
+        self.governor.register_cache('analytics', self.analytics.trim)
+        self.logger.info("Analytics recorder initialized")
+
+    def _init_secrets_audit(self):
+        """Настройка журнала доступа к секретам (файл или journald через логгер)"""
+        audit = self.secrets.audit
+        audit.path = self.config.get('secrets_audit_log_path')
+        audit.flush_interval = self.config.get('secrets_audit_flush_interval_seconds') or 5.0
+        audit.resize(self.config.get('secrets_audit_buffer_size') or 4096)
+        self.logger.info(f"Secrets audit log: {audit.path or 'journald'}")
+
+    def _init_http(self):
+        """Общий пул исходящих HTTP-соединений (сессия создается при старте в event loop)"""
+        self.http: Optional[HttpClientPool] = None
+        self.http_polling: Optional[HttpClientPool] = None
+        if not AIOHTTP_AVAILABLE:
+            self.logger.warning("aiohttp not available, using python-telegram-bot default HTTP client")
+            return
+        self.http = HttpClientPool(
+            limit=self.config.get('http_pool_size') or 100,
+            limit_per_host=self.config.get('http_pool_per_host') or 50,
+            timeout=self.config.get('request_timeout_seconds') or 30,
+            keepalive=self.config.get('http_keepalive_seconds') or 30.0,
+            dns_cache_ttl=self.config.get('http_dns_cache_ttl_seconds') or 300,
+            tracer=self.tracer
+        )
+        # Long polling getUpdates держит соединение на каждого бота постоянно: отдельный
+        # пул без лимитов, чтобы десятки ботов не заняли лимит на хост для sendMessage
+        self.http_polling = HttpClientPool(
+            limit=0,
+            limit_per_host=0,
+            timeout=None,
+            keepalive=self.config.get('http_keepalive_seconds') or 30.0,
+            dns_cache_ttl=self.config.get('http_dns_cache_ttl_seconds') or 300
+        )
+        self.governor.register_cache('http', self.http.trim)
+        self.governor.register_cache('http_polling', self.http_polling.trim)
+
+    def _write_analytics_batch(self, events: List[tuple]):
+        """Записать пакет событий через COPY (отдельное соединение, чтобы не блокировать обработчики)"""
+        with self._analytics_lock:
+            self._copy_analytics_batch(events)
+
+    def _copy_analytics_batch(self, events: List[tuple]):
+        if self._analytics_connection is None or self._analytics_connection.closed:
+            self._analytics_connection = self._connect_database()
+            with self._analytics_connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE TABLE IF NOT EXISTS analytics_events ("
+                    "id BIGSERIAL PRIMARY KEY, "
+                    "created_at TIMESTAMPTZ NOT NULL, "
+                    "event_type TEXT NOT NULL, "
+                    "chat_id BIGINT, "
+                    "user_id BIGINT, "
+                    "payload JSONB)"
+                )
+            self._analytics_connection.commit()
+
+        data = io.StringIO()
+        writer = csv.writer(data)
+        for ts, event_type, chat_id, user_id, payload in events:
+            writer.writerow((
+                datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                event_type,
+                chat_id,
+                user_id,
+                json.dumps(payload) if payload is not None else None
+            ))
+        data.seek(0)
+
+        try:
+            with self._analytics_connection.cursor() as cursor:
+                cursor.copy_expert(
+                    "COPY analytics_events (created_at, event_type, chat_id, user_id, payload) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    data
+                )
+            self._analytics_connection.commit()
+        except Exception:
+            if not self._analytics_connection.closed:
+                self._analytics_connection.rollback()
+            raise
+
+    def _ping_database(self):
+        """Проверка PostgreSQL (с переподключением при потере соединения)"""
+        if self.db_connection is None or self.db_connection.closed:
+            self.db_connection = self._connect_database()
+        with self.db_connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.db_connection.rollback()
+
+    def _ping_redis(self):
+        """Проверка Redis (с переподключением, если при старте он был недоступен)"""
+        if self.redis_client is None:
+            self.redis_client = self._connect_redis()
+            return
+        self.redis_client.ping()
+
+    async def call_dependency(self, name: str, func: Callable, *args, timeout: Optional[float] = None):
+        """Вызов блокирующей операции зависимости через circuit breaker"""
+        operation = getattr(func, '__name__', type(func).__name__)
+        with self.tracer.span(f'{name}.{operation}', kind='client', **{'peer.service': name}):
+            breaker = self.breakers.get(name)
+            if breaker is None:
+                return await asyncio.to_thread(func, *args)
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit '{name}' is open")
+
+            try:
+                result = await asyncio.wait_for(asyncio.to_thread(func, *args), timeout or self.dependency_timeout)
+            except Exception as e:
+                breaker.record_failure(e)
+                raise
+            except BaseException:
+                # Отмена ничего не говорит о зависимости, но без освобождения
+                # пробной попытки цепь навсегда осталась бы в half-open
+                breaker.release_trial()
+                raise
+            breaker.record_success()
+            return result
+
+    async def _probe_dependencies(self, interval: float = 5.0):
+        """Фоновый опрос зависимостей; в open опрос идет только по истечении backoff"""
+        while True:
+            for name, probe in self._probes.items():
+                try:
+                    await self.call_dependency(name, probe)
+                except CircuitOpenError:
+                    pass
+                except Exception as e:
+                    self.logger.debug(f"Dependency probe '{name}' failed: {e}")
+            await asyncio.sleep(interval)
+
+    @property
+    def ready(self) -> bool:
+        """Готовность: нет перегрузки и ни одна критичная зависимость не разомкнута"""
+        if not self.governor.ready:
+            return False
+        return not any(b.critical and b.state == CircuitBreaker.OPEN for b in self.breakers.values())
+
+    def start_background_tasks(self):
+        """Запуск фоновых задач (вызывается из lifespan внутри event loop)"""
+        self._background_tasks.append(asyncio.create_task(self.governor.run()))
+        if self.analytics:
+            # Не входит в _background_tasks: останавливается через stop(), а не отменой
+            self._analytics_task = asyncio.create_task(self.analytics.run())
+        self._background_tasks.append(asyncio.create_task(self.secrets.audit.run()))
+        if self.tracer.enabled:
+            self._background_tasks.append(asyncio.create_task(self.tracer.run()))
+        if self._probes:
+            self._background_tasks.append(asyncio.create_task(self._probe_dependencies()))
+
+    async def stop_background_tasks(self):
+        """Остановка фоновых задач"""
+        # Дописываем накопленные события аналитики перед остановкой: flusher
+        # доводит текущий пакет и сбрасывает остаток сам
+        if self._analytics_task:
+            self.analytics.stop()
+            written = await self._analytics_task
+            self._analytics_task = None
+            self.logger.info(f"Analytics flushed on shutdown: {written} events")
+
+        for task in self._background_tasks:
+            task.cancel()
+        for task in self._background_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._background_tasks.clear()
+
+        await self.secrets.audit.flush()
+        await self.tracer.flush()
+        if self.http:
+            await self.http.close()
+            await self.http_polling.close()
+
+
+class TelegramBot:
+    """Основной класс Telegram бота для Docker"""
+
+    def __init__(self, name: str = 'default', secrets: Optional[SecretsManager] = None,
+                 infra: Optional[BotInfrastructure] = None):
+        self.name = name
+        self.secrets = secrets or SecretsManager()
+        self.config = self.secrets.get_config()
+        if infra is None:
+            # Одиночный режим: бот владеет инфраструктурой процесса
+            self.logger = setup_logging(self.config)
+            infra = BotInfrastructure(self.secrets, self.config, self.logger)
+            self._owns_infra = True
+        else:
+            self.logger = logging.getLogger(f"{__name__}.{name}")
+            self._owns_infra = False
+        self.infra = infra
+        self._init_notifications()
+        self.application: Optional[Application] = None
+        self.running = False
+        self._background_tasks: List[asyncio.Task] = []
+        self._stop_event = asyncio.Event()
+        self.stats = {'updates': 0, 'rejected': 0, 'errors': 0}
+        self.last_update_at: Optional[float] = None
+
+        # Graceful shutdown (в режиме BotHost сигналы обрабатывает uvicorn)
+        if self._owns_infra:
+            signal.signal(signal.SIGTERM, self._signal_handler)
+            signal.signal(signal.SIGINT, self._signal_handler)
+
+    def _init_notifications(self):
+        """Инициализация рассылок (требует enable_notifications и Redis)"""
+        self.broadcast: Optional[BroadcastScheduler] = None
+        if not self.config.get('enable_notifications'):
+            return
+        if not self.infra.redis_client:
+            self.logger.warning("Notifications enabled but Redis is not available")
+            return
+
+        # У каждого бота свои подписчики и очередь рассылок
+        prefix = self.config.get('cache_redis_prefix') or 'telegram_bot:'
+        if not self._owns_infra:
+            prefix = f'{prefix}{self.name}:'
+
+        store = BroadcastStore(self.infra.redis_client, prefix)
+        self.broadcast = BroadcastScheduler(
+            store,
+            self._send_message,
+            partial(self.infra.call_dependency, 'redis'),
+            rate_per_second=self.config.get('notifications_rate_per_second') or 25.0,
+            per_chat_interval=self.config.get('notifications_per_chat_interval_seconds') or 1.0,
+            should_run=lambda: self.infra.governor.ready
+        )
+        self.infra.governor.register_cache(f'broadcast:{self.name}', self.broadcast.trim)
+        self.logger.info("Broadcast scheduler initialized")
+
+    async def _send_message(self, chat_id: int, text: str):
+        await self.application.bot.send_message(chat_id=chat_id, text=text)
+
+    def start_background_tasks(self):
+        """Запуск фоновых задач (вызывается из lifespan внутри event loop)"""
+        if self._owns_infra:
+            self.infra.start_background_tasks()
+
+    async def stop_background_tasks(self):
+        """Остановка фоновых задач бота (и инфраструктуры в одиночном режиме)"""
+        for task in self._background_tasks:
+            task.cancel()
+        for task in self._background_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._background_tasks.clear()
+
+        if self._owns_infra:
+            await self.infra.stop_background_tasks()
+
+    def _guarded(self, handler, priority: int = PRIORITY_NORMAL):
+        """Обернуть обработчик admission control и лимитом параллельности"""
+        governor = self.infra.governor
+        tracer = self.infra.tracer
+
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            with tracer.trace(f'telegram.update {handler.__name__}', bot=self.name,
+                              handler=handler.__name__, update_id=update.update_id) as span:
+                self.stats['updates'] += 1
+                self.last_update_at = time.time()
+                if self.infra.analytics:
+                    self.infra.analytics.record(
+                        'command',
+                        chat_id=update.effective_chat.id if update.effective_chat else None,
+                        user_id=update.effective_user.id if update.effective_user else None,
+                        payload={'command': handler.__name__, 'bot': self.name}
+                    )
+                if not governor.admit(priority):
+                    self.stats['rejected'] += 1
+                    if span:
+                        span.set_attribute('rejected', governor.level)
+                    self.logger.warning(f"Rejected {handler.__name__} under {governor.level} resource pressure")
+                    if update.message:
+                        await update.message.reply_text("⏳ Бот перегружен, попробуйте позже")
+                    return
+                async with governor.limiter:
+                    try:
+                        await handler(update, context)
+                    except Exception:
+                        self.stats['errors'] += 1
+                        raise
+        wrapper.__name__ = handler.__name__
+        return wrapper
+
     def _signal_handler(self, signum, frame):
         """Обработчик сигналов для graceful shutdown"""
         self.logger.info(f"Received signal {signum}, shutting down gracefully...")
-        self.running = False
-        if self.application:
-            asyncio.create_task(self.application.stop())
+        self._stop_event.set()
+
+    async def stop(self):
+        """Остановить polling; run_bot завершится после остановки Application"""
+        self._stop_event.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние бота для health endpoints"""
+        data = {
+            "name": self.name,
+            "username": self.config.get('telegram_bot_username'),
+            "running": self.running,
+            "stats": dict(self.stats),
+            "last_update_at": datetime.fromtimestamp(self.last_update_at).isoformat() if self.last_update_at else None,
+        }
+        if self.broadcast:
+            data["notifications"] = self.broadcast.snapshot()
+        return data
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         try:
+            if self.broadcast:
+                try:
+                    await self.infra.call_dependency('redis', self.broadcast.store.add_subscriber, update.effective_chat.id)
+                except Exception as e:
+                    self.logger.debug(f"Failed to register subscriber: {e}")
+
             username = self.config.get('telegram_bot_username', 'Bot')
             await update.message.reply_text(
                 f'🚀 Привет! Я {username}!\n\n'
@@ -424,6 +2457,9 @@ class TelegramBot:
             "/stats - Статистика работы\n"
             "/ping - Проверка отклика"
         )
+        if self.broadcast:
+            help_text += "\n/broadcast <token> <text> - Рассылка подписчикам"
+
         await update.message.reply_text(help_text)
 
     async def info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -433,8 +2469,8 @@ class TelegramBot:
                 f'🤖 Бот: {self.config.get("telegram_bot_username", "Unknown")}',
                 '🐳 Контейнер: Docker',
                 f'🔐 Секреты: {"загружены" if self.secrets else "ошибка"}',
-                f'🗄️ БД: {"подключена" if getattr(self, "db_connection", None) else "недоступна"}',
-                f'⚡ Кэш: {"работает" if getattr(self, "redis_client", None) else "недоступен"}',
+                f'🗄️ БД: {"подключена" if self.infra.db_connection else "недоступна"}',
+                f'⚡ Кэш: {"работает" if self.infra.redis_client else "недоступен"}',
                 f'📊 Аналитика: {"включена" if self.config.get("enable_analytics") else "выключена"}',
                 f'🔔 Уведомления: {"включены" if self.config.get("enable_notifications") else "выключены"}'
             ]
@@ -455,24 +2491,28 @@ class TelegramBot:
 
             # Проверка компонентов
             checks = []
+            infra = self.infra
 
             # Database check
-            if hasattr(self, 'db_connection') and self.db_connection:
+            if 'database' in infra.breakers:
                 try:
-                    with self.db_connection.cursor() as cursor:
-                        cursor.execute("SELECT 1")
+                    await infra.call_dependency('database', infra._ping_database)
                     checks.append("✅ База данных")
-                except:
+                except CircuitOpenError:
+                    checks.append("❌ База данных (circuit open)")
+                except Exception:
                     checks.append("❌ База данных")
             else:
                 checks.append("⚠️ База данных не настроена")
 
             # Redis check
-            if hasattr(self, 'redis_client') and self.redis_client:
+            if 'redis' in infra.breakers:
                 try:
-                    self.redis_client.ping()
+                    await infra.call_dependency('redis', infra._ping_redis)
                     checks.append("✅ Redis кэш")
-                except:
+                except CircuitOpenError:
+                    checks.append("❌ Redis кэш (circuit open)")
+                except Exception:
                     checks.append("❌ Redis кэш")
             else:
                 checks.append("⚠️ Redis не настроен")
@@ -491,6 +2531,38 @@ class TelegramBot:
             self.logger.error(f"Error in health_command: {e}")
             await update.message.reply_text("❌ Ошибка проверки здоровья")
 
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /broadcast"""
+        try:
+            # Отдельный секрет: токен /health вводится в чатах мониторинга и не должен
+            # давать права писать всем подписчикам
+            broadcast_token = self.config.get('broadcast_token')
+            admin_chat_ids = self.config.get('broadcast_admin_chat_ids')
+            if not broadcast_token:
+                await update.message.reply_text('❌ Рассылки не настроены')
+                return
+            if admin_chat_ids and update.effective_chat.id not in admin_chat_ids:
+                self.logger.warning(f"Broadcast attempt from non-admin chat {update.effective_chat.id}")
+                await update.message.reply_text('❌ Нет доступа')
+                return
+            if not context.args or not hmac.compare_digest(context.args[0], broadcast_token):
+                await update.message.reply_text('❌ Неверный токен')
+                return
+
+            text = ' '.join(context.args[1:])
+            if not text:
+                await update.message.reply_text('❌ Укажите текст рассылки')
+                return
+
+            store = self.broadcast.store
+            chat_ids = await self.infra.call_dependency('redis', store.subscribers)
+            job_id = await self.infra.call_dependency('redis', store.create_job, text, chat_ids)
+            await update.message.reply_text(f'📣 Рассылка {job_id} поставлена в очередь: {len(chat_ids)} получателей')
+
+        except Exception as e:
+            self.logger.error(f"Error in broadcast_command: {e}")
+            await update.message.reply_text("❌ Ошибка постановки рассылки")
+
     async def ping_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /ping"""
         await update.message.reply_text("🏓 Pong!")
@@ -506,30 +2578,111 @@ class TelegramBot:
             if not bot_token:
                 raise ValueError("Telegram bot token not configured")
 
-            self.logger.info("Starting Telegram bot...")
-            self.application = Application.builder().token(bot_token).build()
+            self.logger.info(f"Starting Telegram bot '{self.name}'...")
+            builder = Application.builder().token(bot_token)
+            api_base_url = self.config.get('telegram_api_base_url')
+            if api_base_url:
+                # Локальный Bot API server или fake API нагрузочного теста
+                builder = builder.base_url(api_base_url)
+            if self.infra.http:
+                # Запросы к Bot API идут через общий keep-alive пул; long polling
+                # получает read-таймаут поверх таймаута getUpdates
+                request_timeout = self.config.get('request_timeout_seconds') or 30
+                builder = builder.request(PooledBotRequest(self.infra.http, read_timeout=request_timeout))
+                builder = builder.get_updates_request(PooledBotRequest(self.infra.http_polling))
+            # Без concurrent_updates PTB обрабатывает апдейты по одному, и лимит
+            # параллельности governor.limiter ничего бы не ограничивал
+            builder = builder.concurrent_updates(self.infra.governor.max_concurrent_requests)
+            self.application = builder.build()
+            # Пул доступен обработчикам: context.bot_data['http']
+            self.application.bot_data['http'] = self.infra.http
 
             # Добавление обработчиков команд
-            self.application.add_handler(CommandHandler("start", self.start_command))
-            self.application.add_handler(CommandHandler("help", self.help_command))
-            self.application.add_handler(CommandHandler("info", self.info_command))
-            self.application.add_handler(CommandHandler("health", self.health_command))
-            self.application.add_handler(CommandHandler("ping", self.ping_command))
+            self.application.add_handler(CommandHandler("start", self._guarded(self.start_command)))
+            self.application.add_handler(CommandHandler("help", self._guarded(self.help_command, PRIORITY_LOW)))
+            self.application.add_handler(CommandHandler("info", self._guarded(self.info_command, PRIORITY_LOW)))
+            self.application.add_handler(CommandHandler("health", self._guarded(self.health_command, PRIORITY_HIGH)))
+            self.application.add_handler(CommandHandler("ping", self._guarded(self.ping_command, PRIORITY_LOW)))
+            if self.broadcast:
+                self.application.add_handler(CommandHandler("broadcast", self._guarded(self.broadcast_command)))
+
+            # run_polling управляет event loop сам, поэтому внутри uvicorn
+            # (и для нескольких ботов в одном loop) используем ручной жизненный цикл
+            await self.application.initialize()
+            await self.application.start()
+            await self.application.updater.start_polling()
+
+            if self.broadcast:
+                self._background_tasks.append(asyncio.create_task(self.broadcast.run()))
 
             self.running = True
             self.logger.info("Bot started successfully")
 
-            # Запуск бота
-            await self.application.run_polling(
-                close_loop=False,
-                stop_signals=()
-            )
+            await self._stop_event.wait()
 
         except Exception as e:
             self.logger.error(f"Error running bot: {e}")
             raise
         finally:
             self.running = False
+            if self.application:
+                try:
+                    if self.application.updater and self.application.updater.running:
+                        await self.application.updater.stop()
+                    if self.application.running:
+                        await self.application.stop()
+                    await self.application.shutdown()
+                except Exception as e:
+                    self.logger.error(f"Error stopping bot: {e}")
+
+class BotHost:
+    """Несколько ботов в одном процессе и одном event loop
+
+    Определения ботов берутся из секретов bots/<name>/..., а БД, Redis,
+    кэш секретов, контроль нагрузки и аналитика общие для всех ботов.
+    """
+
+    def __init__(self, secrets: Optional[SecretsManager] = None):
+        self.secrets = secrets or SecretsManager()
+        self.config = self.secrets.get_config()
+        self.logger = setup_logging(self.config)
+        self.infra = BotInfrastructure(self.secrets, self.config, self.logger)
+
+        self.bots: Dict[str, TelegramBot] = {}
+        for name in self.secrets.list_namespaces('bots'):
+            try:
+                bot_secrets = self.secrets.namespace(f'bots/{name}')
+                if bot_secrets._lookup('telegram-bot-token', 2) is None:
+                    raise ValueError(f"secret 'bots/{name}/telegram-bot-token' not found")
+                self.bots[name] = TelegramBot(name=name, secrets=bot_secrets, infra=self.infra)
+            except Exception as e:
+                self.logger.error(f"Failed to load bot '{name}': {e}")
+
+        if not self.bots:
+            self.logger.warning("No bot definitions found under 'bots/'")
+        self.logger.info(f"Loaded {len(self.bots)} bots: {', '.join(sorted(self.bots))}")
+
+    def start_background_tasks(self):
+        self.infra.start_background_tasks()
+
+    async def stop_background_tasks(self):
+        for bot in self.bots.values():
+            await bot.stop_background_tasks()
+        await self.infra.stop_background_tasks()
+
+    async def run_bots(self):
+        """Запуск всех ботов; отказ одного бота не останавливает остальные"""
+        results = await asyncio.gather(*(bot.run_bot() for bot in self.bots.values()), return_exceptions=True)
+        for name, result in zip(self.bots, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Bot '{name}' stopped with error: {result}")
+
+    async def stop(self):
+        for bot in self.bots.values():
+            await bot.stop()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: bot.snapshot() for name, bot in self.bots.items()}
 
 # Production-ready health check endpoints для Docker
 if FASTAPI_AVAILABLE:
@@ -537,13 +2690,11 @@ if FASTAPI_AVAILABLE:
     async def health_check():
         """Production health check endpoint для Docker"""
         try:
-            # Базовые проверки - создаем свой SecretsManager
-            from telegram_bot import SecretsManager
-            secrets_manager = SecretsManager()
-            config = secrets_manager.get_config()
+            async with _health_secrets() as secrets_manager:
+                config = secrets_manager.get_config()
 
-            # Проверяем наличие критических секретов
-            bot_token = secrets_manager.get_secret('telegram-bot-token', required=False)
+                # Проверяем наличие критических секретов
+                bot_token = secrets_manager.get_secret('telegram-bot-token', required=False)
             secrets_loaded = len(config) > 0
             critical_secrets_present = bool(bot_token)
 
@@ -597,43 +2748,42 @@ if FASTAPI_AVAILABLE:
             health_data["uptime"] = None
 
         try:
-            # Проверка SecretsManager - создаем свой экземпляр для health check
-            try:
-                from telegram_bot import SecretsManager
-                secrets_manager = SecretsManager()
-                # Получаем полную конфигурацию для подсчета загруженных секретов
-                full_config = secrets_manager.get_config()
-                secrets_loaded_count = len(full_config) if full_config else 0
-
-                # Проверяем наличие основных секретов
-                critical_secrets = ['telegram-bot-token', 'health-check-token']
-                secrets_status = {}
-                for secret_name in critical_secrets:
-                    secret_value = secrets_manager.get_secret(secret_name, required=False)
-                    secrets_status[secret_name] = "present" if secret_value else "missing"
-
-                health_data["secrets"] = {
-                    "status": "healthy" if all(s == "present" for s in secrets_status.values()) else "degraded",
-                    "loaded_count": secrets_loaded_count,
-                    "critical_secrets": secrets_status
-                }
-            except Exception as e:
-                health_data["secrets"] = {"status": "unhealthy", "error": f"SecretsManager error: {str(e)}"}
+            # Проверка SecretsManager работающего бота (или временного экземпляра)
+            async with _health_secrets() as secrets_manager:
+                try:
+                    # Получаем полную конфигурацию для подсчета загруженных секретов
+                    full_config = secrets_manager.get_config()
+                    secrets_loaded_count = len(full_config) if full_config else 0
+
+                    # Проверяем наличие основных секретов
+                    critical_secrets = ['telegram-bot-token', 'health-check-token']
+                    secrets_status = {}
+                    for secret_name in critical_secrets:
+                        secret_value = secrets_manager.get_secret(secret_name, required=False)
+                        secrets_status[secret_name] = "present" if secret_value else "missing"
+
+                    health_data["secrets"] = {
+                        "status": "healthy" if all(s == "present" for s in secrets_status.values()) else "degraded",
+                        "loaded_count": secrets_loaded_count,
+                        "critical_secrets": secrets_status
+                    }
+                except Exception as e:
+                    health_data["secrets"] = {"status": "unhealthy", "error": f"SecretsManager error: {str(e)}"}
 
-            # Проверка Telegram Bot - проверяем через SecretsManager
-            try:
-                bot_token = secrets_manager.get_secret('telegram-bot-token', required=False)
-                logger.debug(f"[Detailed Health] Telegram Bot Token (partial): {str(bot_token)[:10]}... Length: {len(str(bot_token)) if bot_token else 0}")
+                # Проверка Telegram Bot - проверяем через SecretsManager
+                try:
+                    bot_token = secrets_manager.get_secret('telegram-bot-token', required=False)
+                    logger.debug(f"[Detailed Health] Telegram Bot Token (partial): {str(bot_token)[:10]}... Length: {len(str(bot_token)) if bot_token else 0}")
 
-                if bot_token and len(str(bot_token)) > 10:  # Базовая валидация токена
-                    bot_status = "configured"
-                else:
-                    bot_status = "no_token"
-                logger.debug(f"[Detailed Health] Telegram Bot Status: {bot_status}")
+                    if bot_token and len(str(bot_token)) > 10:  # Базовая валидация токена
+                        bot_status = "configured"
+                    else:
+                        bot_status = "no_token"
+                    logger.debug(f"[Detailed Health] Telegram Bot Status: {bot_status}")
 
-            except Exception as e:
-                bot_status = f"error: {str(e)}"
-                logger.error(f"[Detailed Health] Error checking Telegram Bot: {e}")
+                except Exception as e:
+                    bot_status = f"error: {str(e)}"
+                    logger.error(f"[Detailed Health] Error checking Telegram Bot: {e}")
 
             health_data["components"]["telegram_bot"] = {
                 "status": "healthy" if bot_status in ["configured", "initialized"] else "unhealthy",
@@ -712,6 +2862,28 @@ if FASTAPI_AVAILABLE:
                 health_data["checks"]["disk_space_ok"] = "psutil_required"
                 health_data["checks"]["memory_pressure"] = "psutil_required"
 
+            # Состояние контроля нагрузки (реальные лимиты процесса, а не всей машины)
+            infra = _active_infra()
+            if infra:
+                health_data["governor"] = infra.governor.snapshot()
+                if infra.analytics:
+                    health_data["analytics"] = infra.analytics.snapshot()
+                health_data["secrets_audit"] = infra.secrets.audit.snapshot()
+                health_data["tracing"] = infra.tracer.snapshot()
+                if infra.http:
+                    health_data["http"] = infra.http.snapshot()
+                    health_data["http_polling"] = infra.http_polling.snapshot()
+                for name, breaker in infra.breakers.items():
+                    health_data["components"][name] = {
+                        "status": "healthy" if breaker.state == CircuitBreaker.CLOSED else "unhealthy",
+                        **breaker.snapshot()
+                    }
+                health_data["checks"]["memory_pressure"] = infra.governor.level
+            if bot_instance and bot_instance.broadcast:
+                health_data["notifications"] = bot_instance.broadcast.snapshot()
+            if bot_host:
+                health_data["bots"] = bot_host.snapshot()
+
             # Проверка конфигурации
             config_valid = True
             if bot_instance:
@@ -749,34 +2921,121 @@ if FASTAPI_AVAILABLE:
 
         return health_data
 
-# Глобальный экземпляр бота
+    @app.get("/readyz")
+    async def readiness_check():
+        """Readiness probe: готов ли процесс принимать трафик"""
+        infra = _active_infra()
+        if not infra:
+            return JSONResponse(status_code=503, content={
+                "status": "not_ready",
+                "reason": "bot_not_initialized",
+                "timestamp": datetime.now().isoformat()
+            })
+
+        # Только состояние в памяти: зависимости опрашивает фоновый prober
+        ready = infra.ready
+        reason = None
+        if not infra.governor.ready:
+            reason = "resource_pressure"
+        elif not ready:
+            reason = "dependency_unavailable"
+
+        return JSONResponse(status_code=200 if ready else 503, content={
+            "status": "ready" if ready else "not_ready",
+            "reason": reason,
+            "governor": infra.governor.snapshot(),
+            "dependencies": {name: b.snapshot() for name, b in infra.breakers.items()},
+            "timestamp": datetime.now().isoformat()
+        })
+
+    @app.get("/livez")
+    async def liveness_check():
+        """Liveness probe: процесс и event loop отвечают (без обращения к зависимостям)"""
+        return {
+            "status": "alive",
+            "timestamp": datetime.now().isoformat()
+        }
+
+    @app.get("/bots")
+    async def bots_status():
+        """Состояние и метрики всех ботов процесса"""
+        if bot_host:
+            return bot_host.snapshot()
+        if bot_instance:
+            return {bot_instance.name: bot_instance.snapshot()}
+        return {}
+
+    @app.get("/bots/{name}")
+    async def bot_status(name: str):
+        """Состояние и метрики одного бота"""
+        bots = bot_host.bots if bot_host else ({bot_instance.name: bot_instance} if bot_instance else {})
+        if name not in bots:
+            raise HTTPException(status_code=404, detail=f"Bot '{name}' not found")
+        bot = bots[name]
+        return JSONResponse(status_code=200 if bot.running else 503, content=bot.snapshot())
+
+# Глобальный экземпляр бота (одиночный режим) или хост ботов (BOT_MODE=multi)
 bot_instance: Optional[TelegramBot] = None
+bot_host: Optional[BotHost] = None
+
+def _active_infra() -> Optional[BotInfrastructure]:
+    """Инфраструктура текущего режима работы"""
+    if bot_host:
+        return bot_host.infra
+    if bot_instance:
+        return bot_instance.infra
+    return None
+
+@asynccontextmanager
+async def _health_secrets():
+    """SecretsManager для health endpoints: работающего бота или временный"""
+    infra = _active_infra()
+    if infra:
+        yield infra.secrets
+        return
+    secrets_manager = SecretsManager()
+    try:
+        yield secrets_manager
+    finally:
+        # У временного экземпляра нет фонового writer - иначе записи журнала доступа пропадут
+        secrets_manager.audit.path = secrets_manager._lookup('secrets-audit-log-path', 2)
+        await secrets_manager.audit.flush()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan manager для FastAPI"""
-    global bot_instance
+    global bot_instance, bot_host
 
+    bot_task = None
     # Startup
     try:
-        bot_instance = TelegramBot()
-        # Запускаем бота в фоне
-        bot_task = asyncio.create_task(bot_instance.run_bot())
+        if os.environ.get('BOT_MODE', 'single') == 'multi':
+            bot_host = BotHost()
+            runner = bot_host
+            bot_task = asyncio.create_task(bot_host.run_bots())
+        else:
+            bot_instance = TelegramBot()
+            runner = bot_instance
+            bot_task = asyncio.create_task(bot_instance.run_bot())
+        runner.start_background_tasks()
         yield
     except Exception as e:
         logging.error(f"Failed to start bot: {e}")
         raise
     finally:
         # Shutdown
-        if bot_instance and bot_instance.running:
+        runner = bot_host or bot_instance
+        if runner:
             logging.info("Shutting down bot...")
-            if bot_instance.application:
-                await bot_instance.application.stop()
-            bot_task.cancel()
-            try:
-                await bot_task
-            except asyncio.CancelledError:
-                pass
+            await runner.stop()
+            if bot_task:
+                try:
+                    await asyncio.wait_for(bot_task, timeout=10)
+                except (asyncio.CancelledError, asyncio.TimeoutError):
+                    pass
+                except Exception as e:
+                    logging.error(f"Bot task failed: {e}")
+            await runner.stop_background_tasks()
 
 if FASTAPI_AVAILABLE:
     app.router.lifespan_context = lifespan
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Проверка HttpClientPool и PooledBotRequest на локальных stub-серверах:
+keep-alive, лимит соединений на хост, раздельный учет ожидания пула и
+ответа сервера, таймауты, ошибки и long polling через отдельный пул
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+
+from telegram_bot import HttpClientPool, PooledBotRequest, TELEGRAM_AVAILABLE
+
+SERVER_DELAY = 0.05
+
+
+class StubServer:
+    """Локальный HTTP сервер, считающий соединения и параллельные запросы"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.peers = set()
+        self.active = 0
+        self.peak = 0
+        self.app = web.Application()
+        self.app.router.add_get('/slow', self.slow)
+        self.app.router.add_get('/fail', self.fail)
+        self.app.router.add_post('/bot{token}/{method}', self.bot_api)
+        self.runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', self.port).start()
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def slow(self, request):
+        self.peers.add(request.transport.get_extra_info('peername'))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(float(request.query.get('delay', SERVER_DELAY)))
+        finally:
+            self.active -= 1
+        return web.json_response({'ok': True})
+
+    async def fail(self, request):
+        return web.Response(status=503)
+
+    async def bot_api(self, request):
+        method = request.match_info['method']
+        if method == 'getUpdates':
+            # Long polling: держим соединение до таймаута
+            await asyncio.sleep(1.0)
+            return web.json_response({'ok': True, 'result': []})
+        data = await request.post()
+        return web.json_response({'ok': True, 'result': {'method': method, 'text': data.get('text')}})
+
+
+results = []
+
+
+def check(name: str, condition: bool, details: str = ''):
+    results.append(condition)
+    print(f"   {'✅' if condition else '❌'} {name}" + (f" ({details})" if details else ''))
+
+
+async def test_keepalive_and_cap(server: StubServer):
+    print("\n🔌 Keep-alive и лимит соединений на хост")
+    pool = HttpClientPool(limit=20, limit_per_host=4, timeout=5.0)
+
+    async def get():
+        async with pool.request('GET', f'{server.base_url}/slow') as response:
+            return (await response.json())['ok']
+
+    # Наблюдаем пул во время нагрузки
+    max_utilization = 0.0
+
+    async def observe():
+        nonlocal max_utilization
+        while True:
+            snapshot = pool.snapshot()['hosts'].get(f'127.0.0.1:{server.port}')
+            if snapshot:
+                max_utilization = max(max_utilization, snapshot['utilization'])
+            await asyncio.sleep(0.005)
+
+    observer = asyncio.create_task(observe())
+    ok = await asyncio.gather(*(get() for _ in range(40)))
+    observer.cancel()
+
+    stats = pool.snapshot()['hosts'][f'127.0.0.1:{server.port}']
+    check("все запросы выполнены", all(ok))
+    check("соединения переиспользуются", len(server.peers) <= 4, f"{len(server.peers)} соединений на 40 запросов")
+    check("лимит на хост соблюдается", server.peak <= 4, f"пик {server.peak} параллельных запросов")
+    check("utilization не выше 1.0", max_utilization <= 1.0, f"максимум {max_utilization}")
+    check("задержка сервера без ожидания пула",
+          stats['latency_ms']['p50'] < SERVER_DELAY * 1000 * 3, f"p50 {stats['latency_ms']['p50']} ms")
+    check("ожидание пула учитывается отдельно",
+          stats['wait_ms']['p95'] > SERVER_DELAY * 1000, f"wait p95 {stats['wait_ms']['p95']} ms")
+    check("счетчики вернулись к нулю", stats['waiting'] == 0 and stats['active'] == 0)
+    await pool.close()
+
+
+async def test_per_host_isolation(first: StubServer, second: StubServer):
+    print("\n🌐 Лимиты независимы для разных хостов")
+    pool = HttpClientPool(limit=20, limit_per_host=2, timeout=5.0)
+
+    async def get(server: StubServer):
+        async with pool.request('GET', f'{server.base_url}/slow?delay=0.2') as response:
+            await response.read()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(get(first) for _ in range(2)), *(get(second) for _ in range(2)))
+    elapsed = time.perf_counter() - started
+    check("хосты не ждут друг друга", elapsed < 0.35, f"{elapsed:.2f}s для 2+2 запросов при лимите 2")
+    await pool.close()
+
+
+async def test_timeouts_and_errors(server: StubServer):
+    print("\n⏱️  Таймауты и ошибки")
+    pool = HttpClientPool(limit=10, limit_per_host=2, timeout=0.2)
+    try:
+        async with pool.request('GET', f'{server.base_url}/slow?delay=1') as response:
+            await response.read()
+        check("таймаут запроса", False, "ответ получен")
+    except asyncio.TimeoutError:
+        check("таймаут запроса", True)
+
+    async with pool.request('GET', f'{server.base_url}/fail') as response:
+        status = response.status
+
+    stats = pool.snapshot()['hosts'][f'127.0.0.1:{server.port}']
+    check("5xx возвращается вызывающему", status == 503)
+    check("ошибки учитываются", stats['errors'] == 2, f"errors={stats['errors']}")
+    check("после ошибок нет зависших запросов", stats['waiting'] == 0 and stats['active'] == 0)
+    await pool.close()
+
+
+async def test_bot_request(server: StubServer):
+    print("\n🤖 PooledBotRequest (python-telegram-bot)")
+    if not TELEGRAM_AVAILABLE:
+        check("python-telegram-bot установлен", False)
+        return
+
+    from telegram import Bot
+
+    pool = HttpClientPool(limit=10, limit_per_host=1, timeout=5.0)
+    polling_pool = HttpClientPool(limit=0, limit_per_host=0, timeout=None)
+    bot = Bot('123:TEST', base_url=f'{server.base_url}/bot',
+              request=PooledBotRequest(pool), get_updates_request=PooledBotRequest(polling_pool))
+
+    request = PooledBotRequest(pool)
+    await request.initialize()
+    code, payload = await request.do_request(f'{server.base_url}/bot123:TEST/sendMessage', 'POST')
+    check("запрос к Bot API через пул", code == 200 and json.loads(payload)['ok'])
+
+    # Long polling в отдельном пуле не занимает единственное соединение основного
+    polling = asyncio.create_task(bot.get_updates(timeout=1))
+    await asyncio.sleep(0.1)
+    started = time.perf_counter()
+    code, _ = await request.do_request(f'{server.base_url}/bot123:TEST/sendMessage', 'POST')
+    elapsed = time.perf_counter() - started
+    await polling
+    check("sendMessage не ждет long polling", code == 200 and elapsed < 0.5, f"{elapsed * 1000:.0f} ms")
+
+    await pool.close()
+    await polling_pool.close()
+
+
+async def main():
+    first, second = StubServer(18081), StubServer(18082)
+    await first.start()
+    await second.start()
+    try:
+        await test_keepalive_and_cap(first)
+        await test_per_host_isolation(first, second)
+        await test_timeouts_and_errors(first)
+        await test_bot_request(first)
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+if __name__ == '__main__':
+    print("🧪 Проверка общего HTTP клиента на локальных stub-серверах")
+    print("=" * 60)
+    asyncio.run(main())
+    print("=" * 60)
+    passed = sum(results)
+    print(f"{'✅' if all(results) else '❌'} Пройдено {passed}/{len(results)} проверок")
+    sys.exit(0 if all(results) else 1)
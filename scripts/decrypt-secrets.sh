@@ -4,28 +4,54 @@
 # Для Docker версии см. examples/telegram-bot/decrypt-secrets-docker.sh
 
 set -e
+shopt -s nullglob
+
+# Расшифрованные файлы создаются сразу с правами только для владельца
+umask 077
 
 # Директории
 ENCRYPTED_DIR="/etc/secrets.encrypted"
 SECRETS_DIR="/run/secrets"
 
+# Размер tmpfs рассчитывается по зашифрованным файлам.
+# GPG сжимает данные, поэтому расшифрованный секрет может быть больше
+# зашифрованного - закладываем коэффициент и минимальный запас.
+# tmpfs не резервирует память заранее: RAM занимают только записанные данные.
+TMPFS_MIN_SIZE_KB="${TMPFS_MIN_SIZE_KB:-10240}"
+TMPFS_EXPANSION_FACTOR="${TMPFS_EXPANSION_FACTOR:-4}"
+
+encrypted_files=("$ENCRYPTED_DIR"/*.gpg)
+
+encrypted_bytes=0
+for encrypted_file in "${encrypted_files[@]}"; do
+    encrypted_bytes=$(( encrypted_bytes + $(stat -c %s "$encrypted_file") ))
+done
+
+if [[ -n "$SECRETS_TMPFS_SIZE" ]]; then
+    tmpfs_size="$SECRETS_TMPFS_SIZE"
+else
+    tmpfs_size="$(( encrypted_bytes / 1024 * TMPFS_EXPANSION_FACTOR + TMPFS_MIN_SIZE_KB ))k"
+fi
+
 # Создаем tmpfs для секретов (только в RAM)
-mount -t tmpfs -o size=10M,mode=0700 tmpfs "$SECRETS_DIR"
+mount -t tmpfs -o size="$tmpfs_size",mode=0700 tmpfs "$SECRETS_DIR"
+echo "Mounted tmpfs $SECRETS_DIR (size=$tmpfs_size, encrypted input: $encrypted_bytes bytes)"
 
 # Дешифруем каждый секрет
-for encrypted_file in "$ENCRYPTED_DIR"/*.gpg; do
-    if [[ -f "$encrypted_file" ]]; then
-        secret_name=$(basename "$encrypted_file" .gpg)
-        secret_path="$SECRETS_DIR/$secret_name"
+for encrypted_file in "${encrypted_files[@]}"; do
+    secret_name=$(basename "$encrypted_file" .gpg)
+    secret_path="$SECRETS_DIR/$secret_name"
+    tmp_path="$SECRETS_DIR/.$secret_name.tmp"
 
-        # Дешифруем и сохраняем в RAM
-        gpg --batch --yes --decrypt "$encrypted_file" > "$secret_path"
+    # GPG пишет расшифрованные данные в файл потоком, без буферизации всего
+    # секрета в памяти; атомарный mv не оставляет частично записанных секретов
+    gpg --batch --yes --output "$tmp_path" --decrypt "$encrypted_file"
 
-        # Устанавливаем права только для чтения
-        chmod 0400 "$secret_path"
+    # Устанавливаем права только для чтения
+    chmod 0400 "$tmp_path"
+    mv -f "$tmp_path" "$secret_path"
 
-        echo "Secret $secret_name decrypted to $secret_path"
-    fi
+    echo "Secret $secret_name decrypted to $secret_path"
 done
 
 echo "All secrets decrypted successfully"